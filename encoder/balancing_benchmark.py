@@ -0,0 +1,121 @@
+# This script benchmarks the balancing of the weighted scores of the reference sets (ref_set_processor.py) using the
+# swap modes of RefSetProcessor: 'sequential' (frequency_based_rank_swapping), 'batched' (batched_rank_swapping) and
+# 'global' (global_balancing). Each reference set file and swap mode is run in a fresh process (see
+# benchmark_runner.py), and the following are recorded:
+# 1) wall time of balancing the reference sets
+# 2) peak resident set size (RSS) of the process
+# 3) range of the weighted scores before and after balancing
+# 4) number of swaps performed
+# 5) largest number of q-grams a reference set shares with any other reference set, as a check that the balancing does
+#    not make the reference sets overlap more than the initial reference sets
+# The results are written to a JSON report.
+#
+# Last modified: 15th October 2026
+
+import contextlib
+import os
+import sys
+import time
+
+import numpy
+
+import benchmark_runner
+import command_line
+import ref_set_processor
+
+
+def run_configuration(config):
+    """ Runs a single benchmark configuration, in a fresh process started by benchmark_configuration
+
+     Parameter Description:
+       config : dictionary with the reference set file, q-gram frequency file, swap mode, seed, number of pairs per
+                round and number of workers
+
+     returns:
+        result : dictionary with the measurements of the configuration
+    """
+
+    # the reference set processor prints the progress of the swapping, which is not part of the benchmark
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        processor = ref_set_processor.RefSetProcessor(config['ref_set_file'], config['freq_file'], True,
+                                                      config['seed'], config['mode'], config['swap_pairs'],
+                                                      config['workers'])
+        weighed_random_sets = ref_set_processor.weigh_random_sets(processor.init_random_sets,
+                                                                  processor.frequent_q_grams)
+        initial_scores = weighed_random_sets.get_scores()
+        initial_ref_set_matrix = weighed_random_sets.ref_set_matrix.copy()
+
+        start_time = time.perf_counter()
+        if config['mode'] == 'batched':
+            weighed_random_sets, swaps = ref_set_processor.batched_rank_swapping(
+                weighed_random_sets, config['swap_pairs'], config['workers'])
+        elif config['mode'] == 'global':
+            weighed_random_sets, swaps = ref_set_processor.global_balancing(weighed_random_sets, config['seed'])
+        else:
+            weighed_random_sets, swaps = ref_set_processor.frequency_based_rank_swapping(weighed_random_sets)
+        balancing_time = time.perf_counter() - start_time
+
+    # the peak RSS is read before the overlaps of the reference sets are calculated, which need memory of their own
+    peak_rss_mb = benchmark_runner.get_peak_rss_mb()
+
+    scores = weighed_random_sets.get_scores()
+    sorted_ref_sets = weighed_random_sets.get_sorted_ref_sets()
+    assert (sorted_ref_sets[:, 1:] != sorted_ref_sets[:, :-1]).all(), "Reference sets contain repeated q-grams"
+    assert len(numpy.unique(sorted_ref_sets, axis=0)) == len(sorted_ref_sets), "Reference sets are not unique"
+
+    result = dict(config)
+    result.update({
+        'key': "%s-%s" % (os.path.basename(config['ref_set_file']), config['mode']),
+        'ref_set_count': len(weighed_random_sets),
+        'r_length': weighed_random_sets.r_length,
+        'balancing_time': balancing_time,
+        'peak_rss_mb': peak_rss_mb,
+        'initial_min_score': float(initial_scores.min()),
+        'initial_max_score': float(initial_scores.max()),
+        'min_score': float(scores.min()),
+        'max_score': float(scores.max()),
+        'score_range': float(scores.max() - scores.min()),
+        'score_std': float(scores.std()),
+        'swaps': swaps,
+        'initial_max_overlap': ref_set_processor.get_max_overlap(initial_ref_set_matrix),
+        'max_overlap': ref_set_processor.get_max_overlap(weighed_random_sets.ref_set_matrix)
+    })
+    return result
+
+
+def format_result(result):
+    return "%-32s %9d sets %9.3f s %8.1f MB  range %10.3f -> %9.3f %9d swaps  overlap %d -> %d" % (
+        result['key'], result['ref_set_count'], result['balancing_time'], result['peak_rss_mb'],
+        result['initial_max_score'] - result['initial_min_score'], result['score_range'], result['swaps'],
+        result['initial_max_overlap'], result['max_overlap'])
+
+
+# This program takes in the following command line arguments:
+# 1. The file path the JSON report is written to
+# 2. The path of the CSV file with the frequency of each q-gram in the public database
+# 3. Comma separated paths of the initial reference set files (CSV or binary reference set files)
+#
+# Optional arguments, given after the positional arguments:
+#   --modes      : comma separated swap modes, 'sequential', 'batched' and/or 'global' (default all three)
+#   --seed       : secret seed value of the 'global' mode (default 'benchmark')
+#   --swap-pairs : number of pairs of reference sets in each round of the 'batched' mode (default 1000)
+#   --workers    : number of processes to find the swaps of the 'batched' mode with (default 1)
+
+if __name__ == "__main__":
+    report_path = sys.argv[1]
+    freq_file = sys.argv[2]
+    ref_set_files = sys.argv[3].split(',')
+    options = command_line.parse_optional_args(sys.argv[4:])
+
+    modes = options.get('modes', ','.join(ref_set_processor.SWAP_MODES)).split(',')
+    seed = options.get('seed', 'benchmark')
+    swap_pairs = int(options.get('swap-pairs', 1000))
+    workers = int(options.get('workers', 1))
+
+    for mode in modes:
+        assert mode in ref_set_processor.SWAP_MODES, "Unknown swap mode: %s" % mode
+
+    configs = [{'ref_set_file': ref_set_file, 'freq_file': freq_file, 'mode': mode, 'seed': seed,
+                'swap_pairs': swap_pairs, 'workers': workers} for ref_set_file in ref_set_files for mode in modes]
+    results = benchmark_runner.run_configurations(run_configuration, configs, format_result)
+    benchmark_runner.write_report(report_path, benchmark_runner.create_report(results))
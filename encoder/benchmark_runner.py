@@ -0,0 +1,61 @@
+# This script provides the scaffolding shared by the benchmarks of the reference set generation
+# (ref-set-generator/benchmark.py) and of the balancing of the reference sets (balancing_benchmark.py): each
+# configuration is run in a fresh (spawned) process, so that the peak resident set size (RSS) of the process only
+# covers that configuration, a row is printed for the result of each configuration, and the results are written to a
+# JSON report.
+#
+# Last modified: 15th October 2026
+
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+
+
+def get_peak_rss_mb():
+    # peak RSS of this process in megabytes. ru_maxrss is given in kilobytes on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024.0 ** (2 if sys.platform == 'darwin' else 1))
+
+
+def benchmark_configuration(run_configuration, config):
+    # the configuration is run in a new (spawned) process, so that the peak RSS only covers the configuration
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(run_configuration, (config,))
+
+
+def run_configurations(run_configuration, configs, format_result):
+    """ Runs each configuration in a fresh process, printing a row for each result
+
+     Parameter Description:
+       run_configuration : module level function taking a configuration dictionary and returning the dictionary of
+                           its measurements
+       configs           : iterable of the configuration dictionaries
+       format_result     : function returning the row printed for a result
+
+     returns:
+        results : list of the results of the configurations
+    """
+
+    results = []
+    for config in configs:
+        result = benchmark_configuration(run_configuration, config)
+        results.append(result)
+        print(format_result(result))
+    return results
+
+
+def create_report(results):
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results
+    }
+
+
+def write_report(report_path, report):
+    with open(report_path, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+    print("Wrote the benchmark report to %s" % report_path)
@@ -0,0 +1,80 @@
+# This script calculates the similarities of the packed bit arrays generated by the RSE protocol (as uint64 words)
+# using vectorised popcounts. It is shared by the linkage (linkage.py) and the LSH blocking (lsh_blocking.py).
+#
+# Last modified: 15th October 2026
+
+import numpy
+
+SIMILARITY_MEASURES = ('dice', 'jaccard', 'hamming')
+
+# number of candidate pairs compared at once
+PAIR_CHUNK_SIZE = 100000
+
+# number of bits set in each byte value, used when numpy.bitwise_count is not available (NumPy < 2.0)
+BYTE_POPCOUNT_TABLE = numpy.array([bin(byte_val).count('1') for byte_val in range(256)], dtype=numpy.uint8)
+
+
+def popcount(words):
+    """ Counts the number of 1-bits in each row of a uint64 array, summing over the last axis
+    """
+
+    if hasattr(numpy, 'bitwise_count'):
+        return numpy.bitwise_count(words).sum(axis=-1, dtype=numpy.int64)
+    else:
+        byte_view = words.view(numpy.uint8)
+        return BYTE_POPCOUNT_TABLE[byte_view].sum(axis=-1, dtype=numpy.int64)
+
+
+def calculate_similarities(intersect_counts, bit_counts_a, bit_counts_b, num_bits, measure):
+    """ Calculates the similarities of bit array pairs from the number of common 1-bits and the number of 1-bits of
+    each bit array. The bit counts can be given as arrays broadcasting against the intersection counts.
+
+     Parameter Description:
+       intersect_counts : number of 1-bits set in both bit arrays of each pair
+       bit_counts_a     : number of 1-bits in the first bit array of each pair
+       bit_counts_b     : number of 1-bits in the second bit array of each pair
+       num_bits         : length of the bit arrays
+       measure          : 'dice', 'jaccard', or 'hamming'
+
+     returns:
+        similarities    : array of similarities between 0 and 1
+    """
+
+    if measure == 'dice':
+        denominator = bit_counts_a + bit_counts_b
+        return numpy.divide(2.0 * intersect_counts, denominator, out=numpy.zeros(intersect_counts.shape),
+                            where=denominator > 0)
+    elif measure == 'jaccard':
+        denominator = bit_counts_a + bit_counts_b - intersect_counts
+        return numpy.divide(intersect_counts, denominator, out=numpy.zeros(intersect_counts.shape),
+                            where=denominator > 0)
+    elif measure == 'hamming':
+        return 1.0 - (bit_counts_a + bit_counts_b - 2 * intersect_counts) / num_bits
+    else:
+        raise ValueError("Unknown similarity measure: %s" % measure)
+
+
+def calculate_pair_similarities(words_a, words_b, num_bits, rows_a, rows_b, measure='dice'):
+    """ Calculates the similarities of the given record pairs, chunk by chunk
+
+     Parameter Description:
+       words_a        : uint64 matrix of the packed bit arrays of database a
+       words_b        : uint64 matrix of the packed bit arrays of database b
+       num_bits       : length of the bit arrays
+       rows_a, rows_b : row numbers of the record pairs in the two databases
+       measure        : 'dice', 'jaccard', or 'hamming'
+
+     returns:
+        similarities  : array of the similarities of the record pairs
+    """
+
+    assert measure in SIMILARITY_MEASURES, "Unknown similarity measure: %s" % measure
+
+    sim_chunks = [numpy.zeros(0)]
+    for chunk_start in range(0, len(rows_a), PAIR_CHUNK_SIZE):
+        chunk_words_a = numpy.asarray(words_a[rows_a[chunk_start:chunk_start + PAIR_CHUNK_SIZE]])
+        chunk_words_b = numpy.asarray(words_b[rows_b[chunk_start:chunk_start + PAIR_CHUNK_SIZE]])
+        sim_chunks.append(calculate_similarities(popcount(chunk_words_a & chunk_words_b), popcount(chunk_words_a),
+                                                 popcount(chunk_words_b), num_bits, measure))
+
+    return numpy.concatenate(sim_chunks)
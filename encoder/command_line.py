@@ -0,0 +1,30 @@
+# This script contains the parsing of the command line arguments shared by the programs of the encoder and
+# ref-set-generator directories, so that they do not need to import each other to parse their arguments.
+#
+# Last modified: 15th October 2026
+
+
+def parse_optional_args(arg_list):
+    """ Parses the optional command line arguments given after the positional arguments. Each argument is given as
+    '--name value', or as '--name' alone for flags, which are set to True.
+
+     Parameter Description:
+       arg_list : list of the optional command line arguments
+
+     returns:
+        options : dictionary with the argument names (without the leading '--') as keys
+    """
+
+    options = {}
+    arg_index = 0
+    while arg_index < len(arg_list):
+        arg_name = arg_list[arg_index]
+        assert arg_name.startswith('--'), "Unexpected command line argument: %s" % arg_name
+        if arg_index + 1 < len(arg_list) and not arg_list[arg_index + 1].startswith('--'):
+            options[arg_name[2:]] = arg_list[arg_index + 1]
+            arg_index += 2
+        else:
+            options[arg_name[2:]] = True
+            arg_index += 1
+
+    return options
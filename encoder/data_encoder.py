@@ -10,36 +10,71 @@
 # 8. True/False flag to indicate if frequency-based swapping must be performed on the reference sets
 # 9. path to the q-gram frequency information extracted from the public database
 #       expectations: a CSV file with two columns: q-gram and frequency
-
-
-# Last modified: 21st March 2025
+#
+# The encoder requires the bitarray and NumPy packages (NumPy is used to weigh and swap the reference sets in
+# ref_set_processor.py, and by the matrix engine).
+#
+# Optional arguments, given after the positional arguments:
+#   --two-phase   : count the reference sets each record intersects with first, then select exactly the number of
+#                   1-bits per record, without keeping the initial integer signatures in memory
+#   --engine      : 'index' (default) to count intersections using the inverted q-gram index, or 'matrix' to count
+#                   them for chunks of records using matrix multiplication (requires SciPy for q > 2)
+#   --chunk-size  : number of records per chunk for the matrix engine (default 10000)
+#   --workers     : number of processes to encode the records with (default 1)
+#   --stream      : read and encode the databases in batches of records, writing the encoded records of each batch
+#                   to the output files, so that the databases never need to be held in memory
+#   --batch-size  : number of records in each batch of the streaming mode (default 100000)
+#   --output      : path prefix of the files the encoded databases are written to, as <prefix>_1 and <prefix>_2
+#   --output-format : 'packed' (default) to write a packed bit matrix (.bits) and record identifier (.ids) file per
+#                     database (see encoding_store.py), or 'csv' to write a record identifier and bit array string per row
+#   --swap-mode   : 'sequential' (default) to swap q-grams between the lowest and highest weighted reference sets one at
+#                   a time, 'batched' to swap between many pairs of reference sets in each round first (about 1.3 to 4
+#                   times faster than 'sequential' in balancing_benchmark.py), using --workers processes for rounds of
+#                   long reference sets, or 'global' to redistribute the q-grams over all reference sets first,
+#                   without letting any two reference sets share more q-grams than any two initial reference sets (faster
+#                   than 'sequential' for many short reference sets, slower for long ones, see README.md and
+#                   ref_set_processor.py)
+#   --swap-pairs  : number of pairs of reference sets in each round of the 'batched' swap mode (default 1000)
+#   --save-ref-sets : path of a binary reference set file (see ref_set_store.py) to write the processed reference sets
+#                     to, which can be given as the initial reference sets of later runs (with swapping disabled)
+
+
+# Last modified: 15th October 2026
 
 import csv
 import gzip
+import multiprocessing
 import sys
 import time
 
 import bitarray
 
+import command_line
+import encoding_store
 import ref_set_processor
 
 Q_GRAM_ATTR = "record_q_gram"
 SIGNATURE_ATTR = "signature"
 
+# State shared with the worker processes of the parallel encoding, inherited when forking the process pool
+SHARED_ENCODING_STATE = {}
 
-def generate_database_q_gram_sets(file_name, id_column, sensitive_attrs, q):
-    """Load the data set and generate the record q-gram sets for the sensitive attributes.
-    The q-gram sets are stored in a dictionary with record identifiers (detected using the id_column parameter) as keys.
+
+def iterate_database_q_gram_sets(file_name, id_column, sensitive_attrs, q, headers_used, vocabulary=None):
+    """Read the data set record by record and generate the record q-gram sets for the sensitive attributes, without
+    keeping the records in memory. Records with a missing sensitive attribute or an empty q-gram set are skipped.
 
      Parameter Description:
        file_name      : file path of the database to be read (CSV or CSV.GZ file)
        rec_id_col     : record identifier column of the data file
        sens_attr_list : list of attributes to extract q-grams from
        q              : length of the q-grams to generate
+       headers_used   : list to which the names of the sensitive attributes used are appended
+       vocabulary     : q_gram_vocabulary.QGramVocabulary to convert the q-gram sets into sorted arrays of q-gram
+                        identifiers with, the q-gram sets are kept as sets of strings if None
 
-     returns:
-       qs_dict        : dictionary containing the record q-gram sets
-       headers_used   : names of sensitive attributes used, to ensure that the same attributes are compared for both datasets
+     yields:
+       (rec_id, qs)   : the record identifier and the record q-gram set of each record
     """
 
     # Open a CSV for Gzipped (compressed) CSV.GZ file
@@ -52,8 +87,6 @@ def generate_database_q_gram_sets(file_name, id_column, sensitive_attrs, q):
 
     print('Load data set from file: ' + file_name)
 
-    headers_used = []
-
     header_list = next(csv_reader)
     print('  Record identifier attribute: ' + str(header_list[id_column]))
 
@@ -62,9 +95,6 @@ def generate_database_q_gram_sets(file_name, id_column, sensitive_attrs, q):
         print('    ' + header_list[attr_num])
         headers_used.append(header_list[attr_num])
 
-    rec_num = 0
-    qs_dict = {}
-
     # Iterate through the records in the file
     for rec_list in csv_reader:
         # Get the record identifier
@@ -92,12 +122,40 @@ def generate_database_q_gram_sets(file_name, id_column, sensitive_attrs, q):
             # skip if the generated q-gram set has no elements
             continue
 
+        yield rec_id, qs if vocabulary is None else vocabulary.encode_set(qs)
+
+    in_f.close()
+
+
+def generate_database_q_gram_sets(file_name, id_column, sensitive_attrs, q, vocabulary=None):
+    """Load the data set and generate the record q-gram sets for the sensitive attributes.
+    The q-gram sets are stored in a dictionary with record identifiers (detected using the id_column parameter) as keys.
+
+     Parameter Description:
+       file_name      : file path of the database to be read (CSV or CSV.GZ file)
+       rec_id_col     : record identifier column of the data file
+       sens_attr_list : list of attributes to extract q-grams from
+       q              : length of the q-grams to generate
+       vocabulary     : q_gram_vocabulary.QGramVocabulary to convert the q-gram sets into sorted arrays of q-gram
+                        identifiers with, the q-gram sets are kept as sets of strings if None
+
+     returns:
+       qs_dict        : dictionary containing the record q-gram sets
+       headers_used   : names of sensitive attributes used, to ensure that the same attributes are compared for both datasets
+    """
+
+    headers_used = []
+
+    rec_num = 0
+    qs_dict = {}
+
+    for rec_id, qs in iterate_database_q_gram_sets(file_name, id_column, sensitive_attrs, q, headers_used,
+                                                   vocabulary):
+        rec_num += 1
         qs_dict[rec_id] = {
             Q_GRAM_ATTR: qs
         }
 
-    in_f.close()
-
     print("Generated %d record q-gram sets from the %s file" % (len(qs_dict), file_name))
     if rec_num > len(qs_dict):
         print("Warning: %d duplicate records were detected" % (rec_num - len(qs_dict)))
@@ -105,11 +163,43 @@ def generate_database_q_gram_sets(file_name, id_column, sensitive_attrs, q):
     return qs_dict, headers_used
 
 
-def calculate_average_len(record_q_gram_sets):
+def iterate_database_batches(file_name, id_column, sensitive_attrs, q, batch_size, headers_used, vocabulary=None):
+    """Read the data set in batches of records, generating the record q-gram sets of one batch at a time.
+
+     Parameter Description:
+       file_name      : file path of the database to be read (CSV or CSV.GZ file)
+       rec_id_col     : record identifier column of the data file
+       sens_attr_list : list of attributes to extract q-grams from
+       q              : length of the q-grams to generate
+       batch_size     : number of records in each batch
+       headers_used   : list to which the names of the sensitive attributes used are appended
+       vocabulary     : q_gram_vocabulary.QGramVocabulary to convert the q-gram sets with
+
+     yields:
+       batch_dict     : dictionary containing the record q-gram sets of the batch
+    """
+
+    batch_dict = {}
+    for rec_id, qs in iterate_database_q_gram_sets(file_name, id_column, sensitive_attrs, q, headers_used,
+                                                   vocabulary):
+        batch_dict[rec_id] = {
+            Q_GRAM_ATTR: qs
+        }
+        if len(batch_dict) == batch_size:
+            yield batch_dict
+            batch_dict = {}
+
+    if batch_dict:
+        yield batch_dict
+
+
+def calculate_average_len(record_q_gram_sets, vocabulary=None):
     """Calculate the average length of the q-gram sets generated for the records.
 
      Parameter Description:
        record_q_gram_sets           : list of q-gram sets generated for the records
+       vocabulary                   : vocabulary to print the q-grams of the shortest q-gram set with, if given as
+                                      q-gram identifiers
 
      returns:
         shortest_record_q_gram_set  : length of the shortest record q-gram set
@@ -118,7 +208,8 @@ def calculate_average_len(record_q_gram_sets):
 
     shortest_record_q_gram_set = min(record_q_gram_sets, key=len)
     print("Length of shortest record q-gram set is %d" % len(shortest_record_q_gram_set))
-    print("The shortest q-gram set is: %s" % shortest_record_q_gram_set)
+    print("The shortest q-gram set is: %s" % (shortest_record_q_gram_set if vocabulary is None else
+                                              vocabulary.decode_set(shortest_record_q_gram_set)))
 
     longest_record_q_gram_set = max(record_q_gram_sets, key=len)
     print("Length of longest record q-gram set is %d" % len(longest_record_q_gram_set))
@@ -127,56 +218,142 @@ def calculate_average_len(record_q_gram_sets):
     return len(shortest_record_q_gram_set), 0 if len(lengths) == 0 else round(sum(lengths) / len(lengths))
 
 
-def q_gram_jacc_sim(q_gram_set1, q_gram_set2):
-      """Calculate the Jaccard similarity between the two given sets of q-grams.
+def build_q_gram_index(indexed_r):
+    """ Builds an inverted index that maps every q-gram to the indices of the reference sets containing it. As each
+    q-gram occurs in only about k reference sets, a record only needs to visit the postings of its own q-grams to find
+    every reference set it intersects with.
+
+     Parameter Description:
+       indexed_r     : dictionary containing the indexed reference q-gram sets
+
+     returns:
+        q_gram_index : dictionary with q-grams as keys and the list of reference set indices (in the iteration order
+                       of indexed_r) as values
+    """
+
+    q_gram_index = {}
+    for qs_r_index, qs_r in indexed_r.items():
+        for q_gram in qs_r:
+            if q_gram not in q_gram_index:
+                q_gram_index[q_gram] = []
+            q_gram_index[q_gram].append(qs_r_index)
+
+    return q_gram_index
+
+
+def count_intersections(record_q_gram_set, q_gram_index):
+    """ Counts the number of q-grams the record shares with each reference set, by walking the postings of the record
+    q-grams in the inverted index. Reference sets that do not intersect with the record are never visited.
+
+     Parameter Description:
+       record_q_gram_set : the q-gram set of the record
+       q_gram_index      : inverted index generated using build_q_gram_index
+
+     returns:
+        intersect_counts : dictionary with the indices of the intersecting reference sets as keys and the size of the
+                           intersection as values
+    """
+
+    intersect_counts = {}
+    for q_gram in record_q_gram_set:
+        for qs_r_index in q_gram_index.get(q_gram, ()):
+            intersect_counts[qs_r_index] = intersect_counts.get(qs_r_index, 0) + 1
+
+    return intersect_counts
+
+
+def get_ref_set_length(indexed_r):
+    """ Returns the length shared by all reference sets. As every reference set has the same length, the Jaccard
+    similarity of a record against a reference set is strictly increasing in the size of their intersection, and the
+    reference sets can be ranked using the intersection counts only.
+    """
+
+    ref_set_lengths = set(len(qs_r) for qs_r in indexed_r.values())
+    assert len(ref_set_lengths) == 1, "Reference sets have different lengths: %s" % sorted(ref_set_lengths)
+    return ref_set_lengths.pop()
 
-         Jaccard similarity is calculated between two sets A and B as
 
-            Jaccard similarity (A,B) = |A intersection B|
-                                       ------------------
-                                          | A union B|
+def rank_intersect_counts(intersect_counts, max_count, sign_length):
+    """ Selects the reference sets with the largest intersection counts using a bucket (counting) selection, without
+    sorting all intersecting reference sets
 
-         Returns a similarity value between 0 and 1.
-      """
+     Parameter Description:
+       intersect_counts : dictionary with reference set indices as keys and intersection counts as values
+       max_count        : upper bound of the intersection counts, min(|record q-gram set|, reference set length)
+       sign_length      : number of reference sets to select
 
-      q_gram_intersection_set = q_gram_set1 & q_gram_set2
-      q_gram_union_set =        q_gram_set1 | q_gram_set2
+     returns:
+        ranked_ref_sets : list of (reference set index, intersection count) tuples in descending order of the counts,
+                          with ties broken by the reference set index
+    """
 
-      jacc_sim = float(len(q_gram_intersection_set)) / len(q_gram_union_set)
+    count_buckets = [[] for _ in range(max_count + 1)]
+    for qs_r_index, intersect_count in intersect_counts.items():
+        count_buckets[intersect_count].append(qs_r_index)
 
-      assert 0 <= jacc_sim <= 1.0
+    ranked_ref_sets = []
+    for intersect_count in range(max_count, 0, -1):
+        remaining = sign_length - len(ranked_ref_sets)
+        if remaining <= 0:
+            break
+        count_bucket = count_buckets[intersect_count]
+        if count_bucket:
+            count_bucket.sort()
+            ranked_ref_sets.extend((qs_r_index, intersect_count) for qs_r_index in count_bucket[:remaining])
 
-      return jacc_sim
+    return ranked_ref_sets
 
 
-def gen_init_int_signature(record_store, indexed_r, init_sign_length):
-    """ For each record q-gram set, calculates the similarity against every random set, then extracts the initial
-    integer signature
+def gen_init_int_signature(record_store, indexed_r, init_sign_length, q_gram_index=None, matrix_engine=None,
+                           workers=1, pool=None):
+    """ For each record q-gram set, counts the q-grams shared with every random set it intersects with, then extracts
+    the initial integer signature. Since all reference sets are of the same length, ranking by the intersection count
+    gives the same order as ranking by Jaccard similarity, so the similarities themselves are not calculated.
 
      Parameter Description:
        record_store     : dictionary containing the record q-gram sets
        indexed_r        : dictionary containing the indexed reference q-gram sets
        init_sign_length : length of the initial integer signature
+       q_gram_index     : inverted index of the reference sets (built using build_q_gram_index if not provided)
+       matrix_engine    : matrix_engine.MatrixEngine to count the intersections with, instead of the inverted index
+       workers          : number of processes to split the records between
+       pool             : process pool opened using open_encoding_pool to split the records with (a pool is opened
+                          for this call only if not provided)
 
      returns:
         min_1_bits      : minimum number of ref sets that every record has a non-zero similarity with
-        record_store    : updated record store with initial integer signature
+        record_store    : updated record store with initial integer signature, a list of (reference set index,
+                          intersection count) tuples
     """
 
-    for rec_id, rec_obj in record_store.items():
-        record_sim_store = {}  # stores the similarity calculated against each random set
-        non_zero_count_per_record = 0  # counts the random sets that the record has a non-zero similarity with
-        for qs_r_index, qs_r in indexed_r.items():
-            if qs_r.intersection(rec_obj[Q_GRAM_ATTR]):  # checks if there is an intersection, otherwise sim == 0
-                non_zero_count_per_record += 1
-                record_sim_store[qs_r_index] = q_gram_jacc_sim(rec_obj[Q_GRAM_ATTR], qs_r)
-
-        sorted_sim_store = sorted(record_sim_store.items(), key=lambda item: item[1], reverse=True)
+    if workers > 1:
+        if pool is None and q_gram_index is None and matrix_engine is None:
+            q_gram_index = build_q_gram_index(indexed_r)
+        chunk_results = map_record_chunks(gen_init_int_signature_chunk, record_store, (init_sign_length,), workers,
+                                          pool, get_shared_encoding_state(indexed_r, q_gram_index, matrix_engine))
+        update_signatures(record_store, [signatures for _, signatures in chunk_results])
+        return min(chunk_min_1_bits for chunk_min_1_bits, _ in chunk_results), record_store
+
+    if matrix_engine is not None:
+        matrix_ranking = matrix_engine.rank_ref_sets([rec_obj[Q_GRAM_ATTR] for rec_obj in record_store.values()],
+                                                     init_sign_length)
+    elif q_gram_index is None:
+        q_gram_index = build_q_gram_index(indexed_r)
+    r_length = get_ref_set_length(indexed_r)
 
-        # Updates the record dictionary with the similarities against random sets
+    for rec_id, rec_obj in record_store.items():
+        record_q_gram_set = rec_obj[Q_GRAM_ATTR]
+        if matrix_engine is not None:
+            ranked_ref_sets = next(matrix_ranking)
+        else:
+            intersect_counts = count_intersections(record_q_gram_set, q_gram_index)
+            ranked_ref_sets = rank_intersect_counts(intersect_counts, min(len(record_q_gram_set), r_length),
+                                                    init_sign_length)
+
+        # Updates the record dictionary with the reference sets ranked by their similarity
         record_store[rec_id] = {
-            Q_GRAM_ATTR: rec_obj[Q_GRAM_ATTR],
-            SIGNATURE_ATTR: sorted_sim_store[:min(init_sign_length, non_zero_count_per_record)]
+            Q_GRAM_ATTR: record_q_gram_set,
+            SIGNATURE_ATTR: ranked_ref_sets
         }
 
     min_1_bits = min(len(rec[SIGNATURE_ATTR]) for rec in record_store.values())
@@ -203,18 +380,26 @@ def generate_bit_array_signature(bit_array_length, positions):
     return encoded_ba
 
 
-def extract_signatures(indexed_ref_sets, record_store, n1_bits):
+def extract_signatures(indexed_ref_sets, record_store, n1_bits, workers=1, pool=None):
     """ For each record q-gram set, extracts the indices of the k-most similar random sets and generates the bit array
 
      Parameter Description:
        indexed_ref_sets : dictionary containing the indexed reference sets
        record_store     : dictionary containing the initial integer signatures generated
        n1_bits          : number of 1-bits to be set in the bit array
+       workers          : number of processes to split the records between
+       pool             : process pool opened using open_encoding_pool to split the records with
 
      returns
        record_store  : the updated record dictionary with the generated bit array encodings
     """
 
+    if workers > 1:
+        update_signatures(record_store, map_record_chunks(
+            extract_signatures_chunk, record_store, (n1_bits,), workers, pool,
+            get_shared_encoding_state(indexed_ref_sets)))
+        return record_store
+
     qs_r_count = len(indexed_ref_sets)
 
     for rec_id, rec_obj in record_store.items():
@@ -232,6 +417,287 @@ def extract_signatures(indexed_ref_sets, record_store, n1_bits):
     return record_store
 
 
+def count_touched_ref_sets(record_store, q_gram_index, matrix_engine=None, workers=1, pool=None):
+    """ First phase of the two-phase encoding. For each record, counts the number of reference sets it intersects with
+    as the size of the union of the postings of its q-grams, without calculating any intersection sizes.
+
+     Parameter Description:
+       record_store  : dictionary containing the record q-gram sets
+       q_gram_index  : inverted index of the reference sets
+       matrix_engine : matrix_engine.MatrixEngine to count the reference sets with, instead of the inverted index
+       workers       : number of processes to split the records between
+       pool          : process pool opened using open_encoding_pool to split the records with
+
+     returns:
+        min_touched  : minimum number of ref sets that every record has a non-zero similarity with
+    """
+
+    if workers > 1:
+        return min(map_record_chunks(count_touched_ref_sets_chunk, record_store, (), workers, pool,
+                                     get_shared_encoding_state(None, q_gram_index, matrix_engine)))
+
+    if matrix_engine is not None:
+        return matrix_engine.count_touched_ref_sets([rec_obj[Q_GRAM_ATTR] for rec_obj in record_store.values()])
+
+    min_touched = None
+    for rec_obj in record_store.values():
+        touched_ref_sets = set()
+        for q_gram in rec_obj[Q_GRAM_ATTR]:
+            touched_ref_sets.update(q_gram_index.get(q_gram, ()))
+        if min_touched is None or len(touched_ref_sets) < min_touched:
+            min_touched = len(touched_ref_sets)
+
+    return min_touched
+
+
+def encode_records(record_store, q_gram_index, r_length, qs_r_count, n1_bits, matrix_engine=None, workers=1,
+                   pool=None):
+    """ Second phase of the two-phase encoding. For each record q-gram set, selects exactly n1_bits most similar
+    reference sets and generates the bit array, giving the same encoding as gen_init_int_signature followed by
+    extract_signatures
+
+     Parameter Description:
+       record_store  : dictionary containing the record q-gram sets
+       q_gram_index  : inverted index of the reference sets
+       r_length      : length of the reference sets
+       qs_r_count    : number of reference sets (the length of the bit arrays)
+       n1_bits       : number of 1-bits to be set in the bit array
+       matrix_engine : matrix_engine.MatrixEngine to count the intersections with, instead of the inverted index
+       workers       : number of processes to split the records between
+       pool          : process pool opened using open_encoding_pool to split the records with
+
+     returns
+       record_store : the updated record dictionary with the generated bit array encodings
+    """
+
+    if workers > 1:
+        update_signatures(record_store, map_record_chunks(
+            encode_records_chunk, record_store, (r_length, qs_r_count, n1_bits), workers, pool,
+            get_shared_encoding_state(None, q_gram_index, matrix_engine)))
+        return record_store
+
+    if matrix_engine is not None:
+        matrix_ranking = matrix_engine.rank_ref_sets([rec_obj[Q_GRAM_ATTR] for rec_obj in record_store.values()],
+                                                     n1_bits)
+
+    for rec_id, rec_obj in record_store.items():
+        record_q_gram_set = rec_obj[Q_GRAM_ATTR]
+        if matrix_engine is not None:
+            ranked_ref_sets = next(matrix_ranking)
+        else:
+            intersect_counts = count_intersections(record_q_gram_set, q_gram_index)
+            ranked_ref_sets = rank_intersect_counts(intersect_counts, min(len(record_q_gram_set), r_length), n1_bits)
+        assert len(ranked_ref_sets) == n1_bits
+        signature = generate_bit_array_signature(qs_r_count, [qs_r[0] for qs_r in ranked_ref_sets])
+
+        # Updates the record dictionary with the signature
+        record_store[rec_id] = {
+            Q_GRAM_ATTR: record_q_gram_set,
+            SIGNATURE_ATTR: signature
+        }
+
+    return record_store
+
+
+def set_shared_encoding_state(shared_state):
+    global SHARED_ENCODING_STATE
+    SHARED_ENCODING_STATE = shared_state
+
+
+def get_shared_encoding_state(indexed_r, q_gram_index=None, matrix_engine=None):
+    # the values shared by all chunks of records, which are only passed to the worker processes when a pool is opened
+    return {
+        'indexed_r': indexed_r,
+        'q_gram_index': q_gram_index,
+        'matrix_engine': matrix_engine
+    }
+
+
+def open_encoding_pool(shared_state, workers):
+    """ Opens a process pool for map_record_chunks. The shared state (the reference sets and their index) is inherited
+    by the forked worker processes instead of being pickled for every chunk. Where fork is not available, it is passed
+    once to each worker process. The same pool can be used for all batches, passes and databases of a run.
+
+     Parameter Description:
+       shared_state : dictionary of the values shared by all chunks (see get_shared_encoding_state)
+       workers      : number of worker processes
+
+     returns:
+        pool        : the multiprocessing pool, to be closed by the caller
+    """
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        set_shared_encoding_state(shared_state)
+        pool = multiprocessing.get_context('fork').Pool(workers)
+        set_shared_encoding_state({})
+        return pool
+
+    return multiprocessing.Pool(workers, initializer=set_shared_encoding_state, initargs=(shared_state,))
+
+
+def map_record_chunks(chunk_function, record_store, chunk_args, workers, pool=None, shared_state=None):
+    """ Splits the records into contiguous chunks and applies the chunk function to each chunk in a process pool
+
+     Parameter Description:
+       chunk_function : function applied to each (chunk, chunk_args) tuple, reading the shared state from
+                        SHARED_ENCODING_STATE
+       record_store   : dictionary containing the records
+       chunk_args     : tuple of the (small) arguments of this call, passed with every chunk
+       workers        : number of worker processes
+       pool           : process pool opened using open_encoding_pool, or None to open a pool with the shared state for
+                        this call only
+       shared_state   : dictionary of the values shared by all chunks, used if no pool is given
+
+     returns:
+        chunk_results : list of the results of the chunk function, in the order of the records
+    """
+
+    record_items = list(record_store.items())
+    chunk_size = max(1, -(-len(record_items) // (workers * 4)))
+    record_chunks = [(dict(record_items[chunk_start:chunk_start + chunk_size]), chunk_args)
+                     for chunk_start in range(0, len(record_items), chunk_size)]
+
+    if pool is not None:
+        return pool.map(chunk_function, record_chunks)
+
+    with open_encoding_pool(shared_state, workers) as call_pool:
+        return call_pool.map(chunk_function, record_chunks)
+
+
+def update_signatures(record_store, chunk_signatures):
+    """ Updates the record dictionary with the signatures returned for each chunk, which follow the order of the records
+    """
+
+    signatures = [signature for signature_list in chunk_signatures for signature in signature_list]
+    assert len(signatures) == len(record_store)
+
+    for (rec_id, rec_obj), signature in zip(list(record_store.items()), signatures):
+        record_store[rec_id] = {
+            Q_GRAM_ATTR: rec_obj[Q_GRAM_ATTR],
+            SIGNATURE_ATTR: signature
+        }
+
+
+def gen_init_int_signature_chunk(chunk_task):
+    record_chunk, (init_sign_length,) = chunk_task
+    min_1_bits, record_chunk = gen_init_int_signature(record_chunk, SHARED_ENCODING_STATE['indexed_r'],
+                                                      init_sign_length, SHARED_ENCODING_STATE['q_gram_index'],
+                                                      SHARED_ENCODING_STATE['matrix_engine'])
+    return min_1_bits, [rec_obj[SIGNATURE_ATTR] for rec_obj in record_chunk.values()]
+
+
+def extract_signatures_chunk(chunk_task):
+    record_chunk, (n1_bits,) = chunk_task
+    record_chunk = extract_signatures(SHARED_ENCODING_STATE['indexed_r'], record_chunk, n1_bits)
+    return [rec_obj[SIGNATURE_ATTR] for rec_obj in record_chunk.values()]
+
+
+def count_touched_ref_sets_chunk(chunk_task):
+    record_chunk, _ = chunk_task
+    return count_touched_ref_sets(record_chunk, SHARED_ENCODING_STATE['q_gram_index'],
+                                  SHARED_ENCODING_STATE['matrix_engine'])
+
+
+def encode_records_chunk(chunk_task):
+    record_chunk, (r_length, qs_r_count, n1_bits) = chunk_task
+    record_chunk = encode_records(record_chunk, SHARED_ENCODING_STATE['q_gram_index'], r_length, qs_r_count, n1_bits,
+                                  SHARED_ENCODING_STATE['matrix_engine'])
+    return [rec_obj[SIGNATURE_ATTR] for rec_obj in record_chunk.values()]
+
+
+def scan_database(file_name, id_column, sensitive_attrs, q, batch_size, q_gram_index, matrix_engine=None,
+                  workers=1, vocabulary=None, pool=None):
+    """ Lightweight first pass of the streaming encoding. Reads the data set in batches and collects the statistics
+    needed to decide the number of 1-bits, without keeping any of the records.
+
+     Parameter Description:
+       file_name      : file path of the database to be read (CSV or CSV.GZ file)
+       rec_id_col     : record identifier column of the data file
+       sens_attr_list : list of attributes to extract q-grams from
+       q              : length of the q-grams to generate
+       batch_size     : number of records in each batch
+       q_gram_index   : inverted index of the reference sets
+       matrix_engine  : matrix_engine.MatrixEngine to count the reference sets with, instead of the inverted index
+       workers        : number of processes to split each batch between
+       vocabulary     : q_gram_vocabulary.QGramVocabulary to convert the q-gram sets with
+       pool           : process pool opened using open_encoding_pool to split each batch with
+
+     returns:
+        headers_used  : names of sensitive attributes used
+        rec_count     : number of records read
+        min_len       : length of the shortest record q-gram set
+        len_sum       : sum of the lengths of all record q-gram sets
+        min_touched   : minimum number of ref sets that every record has a non-zero similarity with
+    """
+
+    headers_used = []
+    rec_count = 0
+    min_len = None
+    len_sum = 0
+    min_touched = None
+
+    for batch_dict in iterate_database_batches(file_name, id_column, sensitive_attrs, q, batch_size, headers_used,
+                                               vocabulary):
+        batch_lengths = [len(rec_obj[Q_GRAM_ATTR]) for rec_obj in batch_dict.values()]
+        batch_touched = count_touched_ref_sets(batch_dict, q_gram_index, matrix_engine, workers, pool)
+
+        rec_count += len(batch_dict)
+        len_sum += sum(batch_lengths)
+        if min_len is None or min(batch_lengths) < min_len:
+            min_len = min(batch_lengths)
+        if min_touched is None or batch_touched < min_touched:
+            min_touched = batch_touched
+
+    print("Scanned %d record q-gram sets from the %s file" % (rec_count, file_name))
+
+    return headers_used, rec_count, min_len, len_sum, min_touched
+
+
+def write_encoded_records(signature_writer, record_store):
+    """ Writes the record identifier and the bit array signature of each encoded record using the given writer
+    (see encoding_store.open_signature_writer)
+    """
+
+    signature_writer.write_records((rec_id, rec_obj[SIGNATURE_ATTR]) for rec_id, rec_obj in record_store.items())
+
+
+def stream_encode_database(file_name, id_column, sensitive_attrs, q, batch_size, q_gram_index, r_length, qs_r_count,
+                           n1_bits, signature_writer, matrix_engine=None, workers=1, vocabulary=None, pool=None):
+    """ Second pass of the streaming encoding. Reads the data set in batches, encodes the records of each batch and
+    writes them to the output file before reading the next batch.
+
+     Parameter Description:
+       file_name      : file path of the database to be read (CSV or CSV.GZ file)
+       rec_id_col     : record identifier column of the data file
+       sens_attr_list : list of attributes to extract q-grams from
+       q              : length of the q-grams to generate
+       batch_size     : number of records in each batch
+       q_gram_index   : inverted index of the reference sets
+       r_length       : length of the reference sets
+       qs_r_count     : number of reference sets (the length of the bit arrays)
+       n1_bits        : number of 1-bits to be set in the bit arrays
+       signature_writer : writer the encoded records are written to (see encoding_store.open_signature_writer)
+       matrix_engine  : matrix_engine.MatrixEngine to count the intersections with, instead of the inverted index
+       workers        : number of processes to split each batch between
+       vocabulary     : q_gram_vocabulary.QGramVocabulary to convert the q-gram sets with
+       pool           : process pool opened using open_encoding_pool to split each batch with
+
+     returns:
+        rec_count     : number of records encoded
+    """
+
+    rec_count = 0
+    for batch_dict in iterate_database_batches(file_name, id_column, sensitive_attrs, q, batch_size, [], vocabulary):
+        encoded_batch = encode_records(batch_dict, q_gram_index, r_length, qs_r_count, n1_bits, matrix_engine,
+                                       workers, pool)
+        write_encoded_records(signature_writer, encoded_batch)
+        rec_count += len(encoded_batch)
+
+    print("Wrote %d encoded records to %s" % (rec_count, signature_writer.file_prefix))
+
+    return rec_count
+
+
 if __name__ == '__main__':
     q = 2
     id_col = 0
@@ -251,44 +717,158 @@ if __name__ == '__main__':
     must_swap = eval(sys.argv[8])
     q_gram_frequency_file = sys.argv[9]
 
+    options = command_line.parse_optional_args(sys.argv[10:])
+    two_phase = options.get('two-phase', False)
+    engine_name = options.get('engine', 'index')
+    chunk_size = int(options.get('chunk-size', 10000))
+    num_workers = int(options.get('workers', 1))
+    assert engine_name in ('index', 'matrix'), "Unknown encoding engine: %s" % engine_name
+    stream = options.get('stream', False)
+    batch_size = int(options.get('batch-size', 100000))
+    output_prefix = options.get('output', None)
+    output_format = options.get('output-format', 'packed')
+    ref_set_output_file = options.get('save-ref-sets', None)
+    swap_mode = options.get('swap-mode', 'sequential')
+    swap_pairs = int(options.get('swap-pairs', 1000))
+    assert output_prefix is not None or not stream, "The streaming mode requires an --output prefix"
+
     start_time = time.time()
 
-    # read data files and generate q-gram sets
-    data_dic1, headers1 = generate_database_q_gram_sets(input_file_1, id_col, sens_attr_list_1, q)
-    data_dic2, headers2 = generate_database_q_gram_sets(input_file_2, id_col, sens_attr_list_2, q)
+    # the reference sets are read first, as their vocabulary is used to convert the record q-gram sets
+    RANDOM_GENERATOR = ref_set_processor.RefSetProcessor(init_ref_set_file, q_gram_frequency_file,
+                                                         must_swap, seed, swap_mode, swap_pairs, num_workers)
+    vocabulary = RANDOM_GENERATOR.vocabulary
 
-    assert headers1 == headers2, "The sensitive attributes of the two data files are not the same"
+    if not stream:
+        # read data files and generate q-gram sets
+        data_dic1, headers1 = generate_database_q_gram_sets(input_file_1, id_col, sens_attr_list_1, q, vocabulary)
+        data_dic2, headers2 = generate_database_q_gram_sets(input_file_2, id_col, sens_attr_list_2, q, vocabulary)
 
-    gt_tm_count = len(set(data_dic1.keys()) & set(data_dic2.keys()))
-    print("Number of true matches in the ground truth: %d" % gt_tm_count)
+        assert headers1 == headers2, "The sensitive attributes of the two data files are not the same"
 
-    finished_qs_gen = time.time()
-    print("Time taken to read the data file and generate q-gram sets is %d" % (
-            (finished_qs_gen - start_time) * 1000))
+        gt_tm_count = len(set(data_dic1.keys()) & set(data_dic2.keys()))
+        print("Number of true matches in the ground truth: %d" % gt_tm_count)
 
-    db1_qs = [item[Q_GRAM_ATTR] for item in data_dic1.values()]
-    db2_qs = [item[Q_GRAM_ATTR] for item in data_dic2.values()]
+        finished_qs_gen = time.time()
+        print("Time taken to read the data file and generate q-gram sets is %d" % (
+                (finished_qs_gen - start_time) * 1000))
 
-    min_q_gram_length, avg_q_gram_length = calculate_average_len(db1_qs + db2_qs)
-    print("Average length of the database q-gram sets is: %d" % avg_q_gram_length)
+        db1_qs = [item[Q_GRAM_ATTR] for item in data_dic1.values()]
+        db2_qs = [item[Q_GRAM_ATTR] for item in data_dic2.values()]
 
-    RANDOM_GENERATOR = ref_set_processor.RefSetProcessor(init_ref_set_file, q_gram_frequency_file,
-                                                         must_swap, seed)
+        min_q_gram_length, avg_q_gram_length = calculate_average_len(db1_qs + db2_qs, vocabulary)
+        print("Average length of the database q-gram sets is: %d" % avg_q_gram_length)
 
     reference_q_gram_sets = RANDOM_GENERATOR.process_ref_q_gram_sets()
     print("Generated %d reference q-gram sets" % len(reference_q_gram_sets))
 
-    signature_gen_start = time.time()
-    initial_ls = (k + 1) * min_q_gram_length
+    if ref_set_output_file is not None:
+        import ref_set_store
 
-    input1_smallest_k, record_store1 = gen_init_int_signature(data_dic1, reference_q_gram_sets, initial_ls)
-    input2_smallest_k, record_store2 = gen_init_int_signature(data_dic2, reference_q_gram_sets, initial_ls)
+        ref_set_store.write_ref_sets(ref_set_output_file, reference_q_gram_sets, vocabulary, k)
+        print("Wrote the processed reference sets to %s" % ref_set_output_file)
 
-    num_1_bits = min(input1_smallest_k, input2_smallest_k)
-    print("Number of 1-bits to set is %d" % num_1_bits)
+    signature_gen_start = time.time()
 
-    print("======= Encoding dataset a =======")
-    encoded_db1 = extract_signatures(reference_q_gram_sets, record_store1, num_1_bits)
+    if engine_name == 'matrix':
+        import matrix_engine
 
-    print("======= Encoding dataset b =======")
-    encoded_db2 = extract_signatures(reference_q_gram_sets, record_store2, num_1_bits)
+        reference_index = None
+        ref_matrix_engine = matrix_engine.MatrixEngine(reference_q_gram_sets, chunk_size)
+    else:
+        reference_index = build_q_gram_index(reference_q_gram_sets)
+        ref_matrix_engine = None
+
+    # the worker processes are started once, and used for all batches, passes and databases
+    encoding_pool = None
+    if num_workers > 1:
+        encoding_pool = open_encoding_pool(get_shared_encoding_state(reference_q_gram_sets, reference_index,
+                                                                     ref_matrix_engine), num_workers)
+
+    if stream:
+        # first pass over the data files to find the number of 1-bits, without keeping the records
+        headers1, rec_count1, min_len1, len_sum1, input1_smallest_k = scan_database(
+            input_file_1, id_col, sens_attr_list_1, q, batch_size, reference_index, ref_matrix_engine, num_workers,
+            vocabulary, encoding_pool)
+        headers2, rec_count2, min_len2, len_sum2, input2_smallest_k = scan_database(
+            input_file_2, id_col, sens_attr_list_2, q, batch_size, reference_index, ref_matrix_engine, num_workers,
+            vocabulary, encoding_pool)
+
+        assert headers1 == headers2, "The sensitive attributes of the two data files are not the same"
+
+        min_q_gram_length = min(min_len1, min_len2)
+        print("Length of shortest record q-gram set is %d" % min_q_gram_length)
+        print("Average length of the database q-gram sets is: %d" % round((len_sum1 + len_sum2) /
+                                                                          (rec_count1 + rec_count2)))
+
+        initial_ls = (k + 1) * min_q_gram_length
+        num_1_bits = min(initial_ls, input1_smallest_k, input2_smallest_k)
+        print("Number of 1-bits to set is %d" % num_1_bits)
+
+        r_length = get_ref_set_length(reference_q_gram_sets)
+
+        print("======= Encoding dataset a =======")
+        with encoding_store.open_signature_writer(output_prefix + '_1', output_format,
+                                                  len(reference_q_gram_sets)) as signature_writer:
+            stream_encode_database(input_file_1, id_col, sens_attr_list_1, q, batch_size, reference_index, r_length,
+                                   len(reference_q_gram_sets), num_1_bits, signature_writer, ref_matrix_engine,
+                                   num_workers, vocabulary, encoding_pool)
+
+        print("======= Encoding dataset b =======")
+        with encoding_store.open_signature_writer(output_prefix + '_2', output_format,
+                                                  len(reference_q_gram_sets)) as signature_writer:
+            stream_encode_database(input_file_2, id_col, sens_attr_list_2, q, batch_size, reference_index, r_length,
+                                   len(reference_q_gram_sets), num_1_bits, signature_writer, ref_matrix_engine,
+                                   num_workers, vocabulary, encoding_pool)
+
+    elif two_phase:
+        initial_ls = (k + 1) * min_q_gram_length
+
+        input1_smallest_k = count_touched_ref_sets(data_dic1, reference_index, ref_matrix_engine, num_workers,
+                                                   encoding_pool)
+        input2_smallest_k = count_touched_ref_sets(data_dic2, reference_index, ref_matrix_engine, num_workers,
+                                                   encoding_pool)
+
+        num_1_bits = min(initial_ls, input1_smallest_k, input2_smallest_k)
+        print("Number of 1-bits to set is %d" % num_1_bits)
+
+        r_length = get_ref_set_length(reference_q_gram_sets)
+
+        print("======= Encoding dataset a =======")
+        encoded_db1 = encode_records(data_dic1, reference_index, r_length, len(reference_q_gram_sets), num_1_bits,
+                                     ref_matrix_engine, num_workers, encoding_pool)
+
+        print("======= Encoding dataset b =======")
+        encoded_db2 = encode_records(data_dic2, reference_index, r_length, len(reference_q_gram_sets), num_1_bits,
+                                     ref_matrix_engine, num_workers, encoding_pool)
+    else:
+        initial_ls = (k + 1) * min_q_gram_length
+
+        input1_smallest_k, record_store1 = gen_init_int_signature(data_dic1, reference_q_gram_sets, initial_ls,
+                                                                  reference_index, ref_matrix_engine, num_workers,
+                                                                  encoding_pool)
+        input2_smallest_k, record_store2 = gen_init_int_signature(data_dic2, reference_q_gram_sets, initial_ls,
+                                                                  reference_index, ref_matrix_engine, num_workers,
+                                                                  encoding_pool)
+
+        num_1_bits = min(input1_smallest_k, input2_smallest_k)
+        print("Number of 1-bits to set is %d" % num_1_bits)
+
+        print("======= Encoding dataset a =======")
+        encoded_db1 = extract_signatures(reference_q_gram_sets, record_store1, num_1_bits, num_workers,
+                                         encoding_pool)
+
+        print("======= Encoding dataset b =======")
+        encoded_db2 = extract_signatures(reference_q_gram_sets, record_store2, num_1_bits, num_workers,
+                                         encoding_pool)
+
+    if encoding_pool is not None:
+        encoding_pool.close()
+        encoding_pool.join()
+
+    if output_prefix is not None and not stream:
+        for encoded_db, out_file_prefix in [(encoded_db1, output_prefix + '_1'), (encoded_db2, output_prefix + '_2')]:
+            with encoding_store.open_signature_writer(out_file_prefix, output_format,
+                                                      len(reference_q_gram_sets)) as signature_writer:
+                write_encoded_records(signature_writer, encoded_db)
+            print("Wrote %d encoded records to %s" % (len(encoded_db), out_file_prefix))
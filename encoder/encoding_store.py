@@ -0,0 +1,148 @@
+# This script stores the encoded bit arrays of a database on disk.
+# The packed format consists of two files:
+# 1. <prefix>.bits - a header (magic number, number of records, number of bits) followed by a packed uint8 matrix with
+#                    one row per record, padded to a multiple of 8 bytes so that rows can also be read as uint64 words
+# 2. <prefix>.ids  - the record identifiers, one per line, in the order of the rows of the matrix
+# The reader memory-maps the matrix, so that rows can be sliced without copying them into memory.
+#
+# Last modified: 15th October 2026
+
+import csv
+import struct
+
+import bitarray
+
+SIGNATURE_FILE_MAGIC = b'RSEBITS1'
+HEADER_FORMAT = '<8sQQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+BITS_FILE_EXTENSION = '.bits'
+IDS_FILE_EXTENSION = '.ids'
+
+
+def get_row_bytes(num_bits):
+    # number of bytes per row, rounded up to a multiple of 8 bytes
+    return -(-num_bits // 64) * 8
+
+
+class PackedSignatureWriter:
+    def __init__(self, file_prefix, num_bits):
+        """ Opens the packed signature files for writing. Records can be written in batches using write_records, and
+        the number of records is written to the header when the writer is closed.
+
+         Parameter Description:
+           file_prefix : path prefix of the .bits and .ids files
+           num_bits    : length of the bit arrays (number of reference sets)
+        """
+
+        self.file_prefix = file_prefix
+        self.num_bits = num_bits
+        self.row_bytes = get_row_bytes(num_bits)
+        self.rec_count = 0
+
+        self.bits_file = open(file_prefix + BITS_FILE_EXTENSION, 'wb')
+        self.ids_file = open(file_prefix + IDS_FILE_EXTENSION, 'w', encoding="utf8", newline='\n')
+        self.bits_file.write(struct.pack(HEADER_FORMAT, SIGNATURE_FILE_MAGIC, 0, num_bits))
+
+    def write_records(self, encoded_records):
+        """ Appends the given (record identifier, bit array) pairs to the files
+        """
+
+        padding = bytes(self.row_bytes)
+        for rec_id, signature in encoded_records:
+            assert len(signature) == self.num_bits
+            assert '\n' not in rec_id, "Record identifiers must not contain line breaks"
+            signature_bytes = signature.tobytes()
+            self.bits_file.write(signature_bytes + padding[len(signature_bytes):])
+            self.ids_file.write(rec_id + '\n')
+            self.rec_count += 1
+
+    def close(self):
+        self.bits_file.seek(0)
+        self.bits_file.write(struct.pack(HEADER_FORMAT, SIGNATURE_FILE_MAGIC, self.rec_count, self.num_bits))
+        self.bits_file.close()
+        self.ids_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CsvSignatureWriter:
+    def __init__(self, file_prefix):
+        """ Opens a <prefix>.csv file to write a record identifier and a bit array string per row
+        """
+
+        self.file_prefix = file_prefix
+        self.rec_count = 0
+        self.csv_file = open(file_prefix + '.csv', 'w', newline='')
+        self.csv_writer = csv.writer(self.csv_file)
+
+    def write_records(self, encoded_records):
+        for rec_id, signature in encoded_records:
+            self.csv_writer.writerow([rec_id, signature.to01()])
+            self.rec_count += 1
+
+    def close(self):
+        self.csv_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_signature_writer(file_prefix, output_format, num_bits):
+    """ Opens a writer for the encoded records in the given output format ('packed' or 'csv')
+    """
+
+    assert output_format in ('packed', 'csv'), "Unknown output format: %s" % output_format
+    if output_format == 'packed':
+        return PackedSignatureWriter(file_prefix, num_bits)
+    else:
+        return CsvSignatureWriter(file_prefix)
+
+
+def read_packed_signatures(file_prefix):
+    """ Reads the packed signature files written by PackedSignatureWriter. The bit matrix is memory-mapped, so rows are
+    only read from disk when they are accessed.
+
+     Parameter Description:
+       file_prefix      : path prefix of the .bits and .ids files
+
+     returns:
+        record_ids       : list of the record identifiers, in the order of the rows
+        signature_matrix : read-only memory-mapped uint8 matrix with one row of packed bits per record
+        num_bits         : length of the bit arrays
+    """
+
+    import numpy
+
+    with open(file_prefix + BITS_FILE_EXTENSION, 'rb') as bits_file:
+        magic, rec_count, num_bits = struct.unpack(HEADER_FORMAT, bits_file.read(HEADER_SIZE))
+    assert magic == SIGNATURE_FILE_MAGIC, "%s is not a packed signature file" % (file_prefix + BITS_FILE_EXTENSION)
+
+    with open(file_prefix + IDS_FILE_EXTENSION, encoding="utf8", newline='\n') as ids_file:
+        record_ids = ids_file.read().split('\n')[:-1]
+    assert len(record_ids) == rec_count, "Number of record identifiers does not match the number of signatures"
+
+    row_bytes = get_row_bytes(num_bits)
+    if rec_count == 0:
+        signature_matrix = numpy.zeros((0, row_bytes), dtype=numpy.uint8)
+    else:
+        signature_matrix = numpy.memmap(file_prefix + BITS_FILE_EXTENSION, dtype=numpy.uint8, mode='r',
+                                        offset=HEADER_SIZE, shape=(rec_count, row_bytes))
+
+    return record_ids, signature_matrix, num_bits
+
+
+def row_to_bit_array(signature_row, num_bits):
+    """ Converts a row of the packed signature matrix back into a bit array of the given length
+    """
+
+    signature = bitarray.bitarray()
+    signature.frombytes(signature_row.tobytes())
+    return signature[:num_bits]
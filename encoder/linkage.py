@@ -0,0 +1,344 @@
+# This script links two databases encoded using the RSE protocol. It compares the packed bit arrays of the two
+# encoded databases (as written by data_encoder.py using the packed output format) block by block, calculating
+# their similarities with vectorised popcounts, and writes the record pairs with a similarity of at least the given
+# threshold to a CSV file.
+#
+# It takes the following as input:
+# 1. path prefix of the first encoded database (<prefix>.bits and <prefix>.ids)
+# 2. path prefix of the second encoded database
+# 3. similarity threshold
+# 4. path of the output CSV file, with columns for the two record identifiers and their similarity
+#
+# Optional arguments, given after the positional arguments:
+#   --measure    : 'dice' (default), 'jaccard', or 'hamming' (one minus the normalised Hamming distance)
+#   --block-size : number of records of each database compared at once (by default sized so that the intermediate
+#                  arrays of a block comparison fit in the CPU cache)
+#   --workers    : number of processes to compare the blocks with (default 1)
+#   --lsh        : 'minhash' or 'bits' to only compare the candidate pairs generated by LSH blocking (see
+#                  lsh_blocking.py), instead of all pairs
+#   --bands      : number of LSH bands (default 20)
+#   --rows       : number of hash values in each LSH band (default 4)
+#   --lsh-seed   : seed of the random LSH hash functions (default 0)
+#   --match-sim  : expected similarity of matching pairs, to print the predicted recall and number of candidate pairs
+#                  of the LSH blocking
+#   --top-k      : only keep the k records of the second database sharing the most 1-bits with each record of the
+#                  first database, found using an inverted index of the 1-bit positions (see scan_count_top_k)
+#
+# Last modified: 15th October 2026
+
+import csv
+import multiprocessing
+import sys
+import time
+
+import numpy
+
+import command_line
+import bit_similarity
+import encoding_store
+import lsh_blocking
+
+# Target size in bytes of the intermediate arrays of a block comparison, so that they stay cache-resident
+BLOCK_CACHE_BYTES = 1 << 20
+
+# State shared with the worker processes, inherited when forking the process pool
+SHARED_LINKAGE_STATE = {}
+
+
+def get_default_block_size(num_words):
+    # a block comparison holds block_size x block_size x num_words uint64 words
+    return max(1, int((BLOCK_CACHE_BYTES / (8 * num_words)) ** 0.5))
+
+
+def load_encoded_database(file_prefix):
+    """ Loads an encoded database written in the packed format, viewing the rows of the memory-mapped bit matrix as
+    uint64 words
+
+     Parameter Description:
+       file_prefix : path prefix of the .bits and .ids files
+
+     returns:
+        record_ids : list of the record identifiers
+        words      : memory-mapped uint64 matrix with one row of packed bits per record
+        num_bits   : length of the bit arrays
+    """
+
+    record_ids, signature_matrix, num_bits = encoding_store.read_packed_signatures(file_prefix)
+    words = signature_matrix.view(numpy.uint64)
+    print("Loaded %d encoded records with %d bits from %s" % (len(record_ids), num_bits, file_prefix))
+
+    return record_ids, words, num_bits
+
+
+def compare_blocks(words_a, words_b, bit_counts_a, bit_counts_b, num_bits, measure, threshold):
+    """ Compares every bit array of block a with every bit array of block b
+
+     returns:
+        rows_a, rows_b : row numbers (within the blocks) of the pairs with a similarity of at least the threshold
+        similarities   : similarities of these pairs
+    """
+
+    intersect_counts = bit_similarity.popcount(words_a[:, None, :] & words_b[None, :, :])
+    similarities = bit_similarity.calculate_similarities(intersect_counts, bit_counts_a[:, None], bit_counts_b[None, :],
+                                                         num_bits, measure)
+    rows_a, rows_b = numpy.nonzero(similarities >= threshold)
+
+    return rows_a, rows_b, similarities[rows_a, rows_b]
+
+
+def link_block_row(block_start_a):
+    """ Compares a block of records of database a with all records of database b. Runs in the worker processes,
+    reading the encoded databases from SHARED_LINKAGE_STATE.
+    """
+
+    state = SHARED_LINKAGE_STATE
+    block_size = state['block_size']
+    words_a = numpy.asarray(state['words_a'][block_start_a:block_start_a + block_size])
+    bit_counts_a = state['bit_counts_a'][block_start_a:block_start_a + block_size]
+
+    pair_rows_a = []
+    pair_rows_b = []
+    pair_sims = []
+    for block_start_b in range(0, len(state['words_b']), block_size):
+        words_b = numpy.asarray(state['words_b'][block_start_b:block_start_b + block_size])
+        bit_counts_b = state['bit_counts_b'][block_start_b:block_start_b + block_size]
+        rows_a, rows_b, similarities = compare_blocks(words_a, words_b, bit_counts_a, bit_counts_b,
+                                                      state['num_bits'], state['measure'], state['threshold'])
+        pair_rows_a.append(rows_a + block_start_a)
+        pair_rows_b.append(rows_b + block_start_b)
+        pair_sims.append(similarities)
+
+    if not pair_sims:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0)
+
+    pair_rows_a = numpy.concatenate(pair_rows_a)
+    pair_rows_b = numpy.concatenate(pair_rows_b)
+    pair_order = numpy.lexsort((pair_rows_b, pair_rows_a))  # independent of the block size
+
+    return pair_rows_a[pair_order], pair_rows_b[pair_order], numpy.concatenate(pair_sims)[pair_order]
+
+
+def set_shared_linkage_state(shared_state):
+    global SHARED_LINKAGE_STATE
+    SHARED_LINKAGE_STATE = shared_state
+
+
+def link_databases(words_a, words_b, num_bits, threshold, measure='dice', block_size=None, workers=1):
+    """ Compares all pairs of bit arrays of the two encoded databases, block by block, keeping the pairs with a
+    similarity of at least the threshold. The blocks are small enough for the bit arrays to stay in the CPU cache, and
+    are compared in parallel when more than one worker is used.
+
+     Parameter Description:
+       words_a    : uint64 matrix of the packed bit arrays of database a
+       words_b    : uint64 matrix of the packed bit arrays of database b
+       num_bits   : length of the bit arrays
+       threshold  : minimum similarity of the pairs to keep
+       measure    : 'dice', 'jaccard', or 'hamming'
+       block_size : number of records of each database compared at once (using get_default_block_size if None)
+       workers    : number of processes to compare the blocks with
+
+     returns:
+        rows_a, rows_b : row numbers of the pairs with a similarity of at least the threshold, in the order of the
+                         rows of database a and then database b
+        similarities   : similarities of these pairs
+    """
+
+    assert measure in bit_similarity.SIMILARITY_MEASURES, "Unknown similarity measure: %s" % measure
+    assert words_a.shape[1] == words_b.shape[1], "The bit arrays of the two databases are of different lengths"
+    if block_size is None:
+        block_size = get_default_block_size(words_a.shape[1])
+
+    shared_state = {
+        'words_a': words_a,
+        'words_b': words_b,
+        'bit_counts_a': bit_similarity.popcount(numpy.asarray(words_a)),
+        'bit_counts_b': bit_similarity.popcount(numpy.asarray(words_b)),
+        'num_bits': num_bits,
+        'measure': measure,
+        'threshold': threshold,
+        'block_size': block_size
+    }
+    block_starts_a = range(0, len(words_a), block_size)
+
+    if workers > 1:
+        if 'fork' in multiprocessing.get_all_start_methods():
+            set_shared_linkage_state(shared_state)
+            pool = multiprocessing.get_context('fork').Pool(workers)
+        else:
+            pool = multiprocessing.Pool(workers, initializer=set_shared_linkage_state, initargs=(shared_state,))
+        with pool:
+            block_results = pool.map(link_block_row, block_starts_a)
+    else:
+        set_shared_linkage_state(shared_state)
+        block_results = [link_block_row(block_start_a) for block_start_a in block_starts_a]
+    set_shared_linkage_state({})
+
+    if not block_results:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0)
+
+    rows_a, rows_b, similarities = (numpy.concatenate(results) for results in zip(*block_results))
+    return rows_a, rows_b, similarities
+
+
+def link_candidate_pairs(words_a, words_b, num_bits, rows_a, rows_b, threshold, measure='dice'):
+    """ Compares only the given candidate pairs (for example, generated by lsh_blocking.lsh_candidate_pairs) and keeps
+    the pairs with a similarity of at least the threshold
+
+     returns:
+        rows_a, rows_b : row numbers of the pairs with a similarity of at least the threshold
+        similarities   : similarities of these pairs
+    """
+
+    similarities = bit_similarity.calculate_pair_similarities(words_a, words_b, num_bits, rows_a, rows_b, measure)
+    is_similar = similarities >= threshold
+
+    return rows_a[is_similar], rows_b[is_similar], similarities[is_similar]
+
+
+def build_bit_position_index(words_b, num_bits):
+    """ Builds an inverted index that maps each bit position to the rows of database b with that bit set. As RSE bit
+    arrays only have a small number of 1-bits, each posting list only holds a small fraction of the records.
+
+     Parameter Description:
+       words_b  : uint64 matrix of the packed bit arrays of database b
+       num_bits : length of the bit arrays
+
+     returns:
+        index_starts : array of num_bits + 1 offsets, the rows with bit i set are index_rows[index_starts[i]:
+                       index_starts[i + 1]]
+        index_rows   : the concatenated posting lists, in ascending order of the rows within each list
+    """
+
+    row_chunks = []
+    position_chunks = []
+    chunk_start = 0
+    for bit_chunk in lsh_blocking.iterate_bit_chunks(words_b, num_bits):
+        chunk_rows, chunk_positions = numpy.nonzero(bit_chunk)
+        row_chunks.append(chunk_rows + chunk_start)
+        position_chunks.append(chunk_positions)
+        chunk_start += len(bit_chunk)
+
+    set_rows = numpy.concatenate(row_chunks) if row_chunks else numpy.zeros(0, dtype=numpy.int64)
+    set_positions = numpy.concatenate(position_chunks) if position_chunks else numpy.zeros(0, dtype=numpy.int64)
+
+    position_order = numpy.argsort(set_positions, kind='stable')
+    index_starts = numpy.zeros(num_bits + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(set_positions, minlength=num_bits), out=index_starts[1:])
+
+    return index_starts, set_rows[position_order]
+
+
+def scan_count_top_k(words_a, num_bits, index_starts, index_rows, top_k):
+    """ Finds, for each record of database a, the top_k records of database b sharing the most 1-bits with it. The
+    shared bits are counted (ScanCount) over the posting lists of the 1-bits of the query only, so records of database b
+    that share no 1-bit with the query are never visited.
+
+     Parameter Description:
+       words_a      : uint64 matrix of the packed bit arrays of database a
+       num_bits     : length of the bit arrays
+       index_starts : posting list offsets generated using build_bit_position_index
+       index_rows   : posting lists generated using build_bit_position_index
+       top_k        : number of records of database b to return for each record of database a
+
+     returns:
+        rows_a, rows_b : row numbers of the returned pairs, for each row of database a in descending order of the
+                         number of shared 1-bits, with ties broken by the row of database b
+        shared_counts  : number of 1-bits shared by each returned pair
+    """
+
+    pair_rows_a = []
+    pair_rows_b = []
+    pair_counts = []
+
+    row_a = 0
+    for bit_chunk in lsh_blocking.iterate_bit_chunks(words_a, num_bits):
+        for query_bits in bit_chunk:
+            query_positions = numpy.flatnonzero(query_bits)
+            posting_rows = numpy.concatenate([index_rows[index_starts[pos]:index_starts[pos + 1]]
+                                              for pos in query_positions]) if len(query_positions) > 0 else []
+            if len(posting_rows) > 0:
+                candidate_rows, shared_counts = numpy.unique(posting_rows, return_counts=True)
+                top_order = numpy.lexsort((candidate_rows, -shared_counts))[:top_k]
+                pair_rows_a.append(numpy.full(len(top_order), row_a))
+                pair_rows_b.append(candidate_rows[top_order])
+                pair_counts.append(shared_counts[top_order])
+            row_a += 1
+
+    if not pair_counts:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+
+    return numpy.concatenate(pair_rows_a), numpy.concatenate(pair_rows_b), numpy.concatenate(pair_counts)
+
+
+def link_top_k(words_a, words_b, num_bits, top_k, threshold, measure='dice'):
+    """ Links each record of database a to the top_k records of database b sharing the most 1-bits with it, keeping
+    the pairs with a similarity of at least the threshold
+
+     returns:
+        rows_a, rows_b : row numbers of the pairs with a similarity of at least the threshold
+        similarities   : similarities of these pairs
+    """
+
+    index_starts, index_rows = build_bit_position_index(words_b, num_bits)
+    rows_a, rows_b, shared_counts = scan_count_top_k(words_a, num_bits, index_starts, index_rows, top_k)
+
+    bit_counts_a = bit_similarity.popcount(numpy.asarray(words_a))
+    bit_counts_b = bit_similarity.popcount(numpy.asarray(words_b))
+    similarities = bit_similarity.calculate_similarities(shared_counts, bit_counts_a[rows_a], bit_counts_b[rows_b],
+                                                         num_bits, measure)
+    is_similar = similarities >= threshold
+
+    return rows_a[is_similar], rows_b[is_similar], similarities[is_similar]
+
+
+def write_candidate_pairs(out_file_name, record_ids_a, record_ids_b, rows_a, rows_b, similarities):
+    with open(out_file_name, 'w', newline='') as out_f:
+        csv_writer = csv.writer(out_f)
+        for row_a, row_b, similarity in zip(rows_a.tolist(), rows_b.tolist(), similarities.tolist()):
+            csv_writer.writerow([record_ids_a[row_a], record_ids_b[row_b], '%.6f' % similarity])
+
+    print("Wrote %d candidate pairs to the %s file" % (len(similarities), out_file_name))
+
+
+if __name__ == '__main__':
+    encoded_prefix_a = sys.argv[1]
+    encoded_prefix_b = sys.argv[2]
+    sim_threshold = float(sys.argv[3])
+    output_file = sys.argv[4]
+
+    options = command_line.parse_optional_args(sys.argv[5:])
+    sim_measure = options.get('measure', 'dice')
+    cmp_block_size = int(options['block-size']) if 'block-size' in options else None
+    num_workers = int(options.get('workers', 1))
+    lsh_method = options.get('lsh', None)
+    lsh_bands = int(options.get('bands', 20))
+    lsh_rows = int(options.get('rows', 4))
+    lsh_seed = int(options.get('lsh-seed', 0))
+    expected_match_sim = float(options['match-sim']) if 'match-sim' in options else None
+    top_k_count = int(options['top-k']) if 'top-k' in options else None
+
+    start_time = time.time()
+
+    rec_ids_a, encoded_a, num_bits_a = load_encoded_database(encoded_prefix_a)
+    rec_ids_b, encoded_b, num_bits_b = load_encoded_database(encoded_prefix_b)
+    assert num_bits_a == num_bits_b, "The bit arrays of the two databases are of different lengths"
+
+    if top_k_count is not None:
+        pair_rows_a, pair_rows_b, pair_sims = link_top_k(encoded_a, encoded_b, num_bits_a, top_k_count,
+                                                         sim_threshold, sim_measure)
+    elif lsh_method is not None:
+        if expected_match_sim is not None:
+            lsh_blocking.estimate_lsh_blocking(encoded_a, encoded_b, num_bits_a, lsh_method, lsh_bands, lsh_rows,
+                                               expected_match_sim)
+        candidate_rows_a, candidate_rows_b = lsh_blocking.lsh_candidate_pairs(encoded_a, encoded_b, num_bits_a,
+                                                                              lsh_method, lsh_bands, lsh_rows,
+                                                                              lsh_seed)
+        pair_rows_a, pair_rows_b, pair_sims = link_candidate_pairs(encoded_a, encoded_b, num_bits_a,
+                                                                   candidate_rows_a, candidate_rows_b, sim_threshold,
+                                                                   sim_measure)
+    else:
+        pair_rows_a, pair_rows_b, pair_sims = link_databases(encoded_a, encoded_b, num_bits_a, sim_threshold,
+                                                             sim_measure, cmp_block_size, num_workers)
+    print("Time taken to compare the encoded databases is %d" % ((time.time() - start_time) * 1000))
+
+    write_candidate_pairs(output_file, rec_ids_a, rec_ids_b, pair_rows_a, pair_rows_b, pair_sims)
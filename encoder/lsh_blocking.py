@@ -0,0 +1,187 @@
+# This script provides locality-sensitive hashing (LSH) blocking for the fixed-length bit arrays generated by the RSE
+# protocol, so that only the record pairs colliding in at least one LSH band need to be compared during linkage.
+# Two LSH families are supported:
+# 1. 'bits'    : bit sampling, for the Hamming similarity of the bit arrays
+# 2. 'minhash' : MinHash over the positions of the 1-bits, for the Jaccard similarity of the bit arrays. As RSE bit
+#                arrays are very sparse, most sampled bits are 0 and bit sampling mostly produces all-zero band keys,
+#                so MinHash is generally the better choice for RSE encodings.
+# The hash functions are grouped into 'bands' of 'rows' hash values each, and two records become a candidate pair if all
+# hash values of at least one band are equal.
+#
+# Last modified: 15th October 2026
+
+import numpy
+
+import bit_similarity
+
+LSH_METHODS = ('bits', 'minhash')
+
+# number of records whose bits are unpacked at once
+UNPACK_CHUNK_SIZE = 2000
+
+
+def iterate_bit_chunks(words, num_bits):
+    """ Unpacks the packed bit arrays chunk by chunk into uint8 matrices with one column per bit
+    """
+
+    for chunk_start in range(0, len(words), UNPACK_CHUNK_SIZE):
+        byte_chunk = numpy.asarray(words[chunk_start:chunk_start + UNPACK_CHUNK_SIZE]).view(numpy.uint8)
+        yield numpy.unpackbits(byte_chunk, axis=1)[:, :num_bits]
+
+
+def generate_lsh_functions(method, num_bits, bands, rows, seed):
+    """ Generates the random hash functions of the LSH scheme
+
+     Parameter Description:
+       method   : 'bits' or 'minhash'
+       num_bits : length of the bit arrays
+       bands    : number of bands
+       rows     : number of hash values in each band
+       seed     : seed of the random number generator, the same seed must be used for both databases
+
+     returns:
+        lsh_functions : for 'bits', an array of the bands x rows sampled bit positions, and for 'minhash' a matrix of
+                        bands x rows random permutations of the bit positions
+    """
+
+    assert method in LSH_METHODS, "Unknown LSH method: %s" % method
+    rng = numpy.random.default_rng(seed)
+
+    if method == 'bits':
+        return rng.integers(0, num_bits, size=bands * rows)
+    else:
+        return numpy.array([rng.permutation(num_bits) for _ in range(bands * rows)], dtype=numpy.int64)
+
+
+def calculate_lsh_values(words, num_bits, method, lsh_functions):
+    """ Calculates the bands x rows hash values of each bit array
+
+     Parameter Description:
+       words         : uint64 matrix of the packed bit arrays
+       num_bits      : length of the bit arrays
+       method        : 'bits' or 'minhash'
+       lsh_functions : the hash functions generated using generate_lsh_functions
+
+     returns:
+        lsh_values   : matrix with one row of hash values per record
+    """
+
+    value_chunks = []
+    for bit_chunk in iterate_bit_chunks(words, num_bits):
+        if method == 'bits':
+            value_chunks.append(bit_chunk[:, lsh_functions].astype(numpy.int64))
+        else:
+            # the MinHash value of a record is the smallest permuted position of its 1-bits
+            rec_rows, bit_positions = numpy.nonzero(bit_chunk)
+            chunk_values = numpy.full((len(bit_chunk), len(lsh_functions)), num_bits, dtype=numpy.int64)
+            if len(rec_rows) > 0:
+                row_starts = numpy.flatnonzero(numpy.r_[True, rec_rows[1:] != rec_rows[:-1]])
+                permuted_positions = lsh_functions[:, bit_positions]
+                chunk_values[rec_rows[row_starts]] = numpy.minimum.reduceat(permuted_positions, row_starts, axis=1).T
+            value_chunks.append(chunk_values)
+
+    if not value_chunks:
+        return numpy.zeros((0, len(lsh_functions)), dtype=numpy.int64)
+
+    return numpy.concatenate(value_chunks)
+
+
+def join_bucket_labels(labels_a, labels_b):
+    """ Returns all pairs of a row of database a and a row of database b with the same bucket label
+    """
+
+    order_b = numpy.argsort(labels_b, kind='stable')
+    sorted_labels_b = labels_b[order_b]
+    bucket_starts = numpy.searchsorted(sorted_labels_b, labels_a, side='left')
+    bucket_sizes = numpy.searchsorted(sorted_labels_b, labels_a, side='right') - bucket_starts
+
+    rows_a = numpy.repeat(numpy.arange(len(labels_a)), bucket_sizes)
+    pair_offsets = numpy.arange(len(rows_a)) - numpy.repeat(numpy.cumsum(bucket_sizes) - bucket_sizes, bucket_sizes)
+    rows_b = order_b[bucket_starts[rows_a] + pair_offsets]
+
+    return rows_a, rows_b
+
+
+def lsh_candidate_pairs(words_a, words_b, num_bits, method='minhash', bands=20, rows=4, seed=0):
+    """ Generates the candidate record pairs of the two encoded databases, which are the pairs with the same hash
+    values in at least one band
+
+     Parameter Description:
+       words_a  : uint64 matrix of the packed bit arrays of database a
+       words_b  : uint64 matrix of the packed bit arrays of database b
+       num_bits : length of the bit arrays
+       method   : 'bits' or 'minhash'
+       bands    : number of bands
+       rows     : number of hash values in each band
+       seed     : seed of the random number generator used to generate the hash functions
+
+     returns:
+        rows_a, rows_b : row numbers of the candidate pairs, sorted by the rows of database a and then database b
+    """
+
+    lsh_functions = generate_lsh_functions(method, num_bits, bands, rows, seed)
+    lsh_values_a = calculate_lsh_values(words_a, num_bits, method, lsh_functions)
+    lsh_values_b = calculate_lsh_values(words_b, num_bits, method, lsh_functions)
+
+    pair_codes = []
+    for band in range(bands):
+        band_values = numpy.concatenate([lsh_values_a[:, band * rows:(band + 1) * rows],
+                                         lsh_values_b[:, band * rows:(band + 1) * rows]])
+        _, bucket_labels = numpy.unique(band_values, axis=0, return_inverse=True)
+        bucket_labels = bucket_labels.reshape(-1)
+        band_rows_a, band_rows_b = join_bucket_labels(bucket_labels[:len(words_a)], bucket_labels[len(words_a):])
+        pair_codes.append(band_rows_a * len(words_b) + band_rows_b)
+
+    pair_codes = numpy.unique(numpy.concatenate(pair_codes)) if pair_codes else numpy.zeros(0, dtype=numpy.int64)
+    print("LSH blocking with %d bands of %d rows generated %d candidate pairs" % (bands, rows, len(pair_codes)))
+
+    return pair_codes // len(words_b), pair_codes % len(words_b)
+
+
+def lsh_collision_probability(similarity, bands, rows):
+    """ Probability that a pair of records with the given similarity (Hamming similarity for bit sampling, Jaccard
+    similarity for MinHash) collides in at least one band
+    """
+
+    return 1.0 - (1.0 - numpy.asarray(similarity, dtype=float) ** rows) ** bands
+
+
+def estimate_lsh_blocking(words_a, words_b, num_bits, method, bands, rows, match_similarity, sample_size=100000,
+                          seed=0):
+    """ Predicts the recall and the number of candidate pairs of the LSH blocking for the given parameters. The recall
+    is the collision probability of matching pairs with the given similarity, and the number of candidate pairs is
+    estimated from the similarities of a random sample of all record pairs.
+
+     Parameter Description:
+       words_a          : uint64 matrix of the packed bit arrays of database a
+       words_b          : uint64 matrix of the packed bit arrays of database b
+       num_bits         : length of the bit arrays
+       method           : 'bits' or 'minhash'
+       bands            : number of bands
+       rows             : number of hash values in each band
+       match_similarity : expected similarity of the matching record pairs (can be a list of similarities)
+       sample_size      : number of random record pairs used to estimate the number of candidate pairs
+       seed             : seed of the random number generator used to sample the record pairs
+
+     returns:
+        expected_recall     : expected fraction of the matching pairs that become candidate pairs
+        expected_candidates : expected number of candidate pairs
+    """
+
+    assert method in LSH_METHODS, "Unknown LSH method: %s" % method
+    rng = numpy.random.default_rng(seed)
+    sample_rows_a = rng.integers(0, len(words_a), size=sample_size)
+    sample_rows_b = rng.integers(0, len(words_b), size=sample_size)
+
+    measure = 'hamming' if method == 'bits' else 'jaccard'
+    sample_sims = bit_similarity.calculate_pair_similarities(words_a, words_b, num_bits, sample_rows_a,
+                                                             sample_rows_b, measure)
+
+    expected_recall = float(numpy.mean(lsh_collision_probability(match_similarity, bands, rows)))
+    expected_candidates = float(numpy.mean(lsh_collision_probability(sample_sims, bands, rows))) * \
+        len(words_a) * len(words_b)
+
+    print("Expected recall of LSH blocking with %d bands of %d rows: %f" % (bands, rows, expected_recall))
+    print("Expected number of candidate pairs: %d" % round(expected_candidates))
+
+    return expected_recall, expected_candidates
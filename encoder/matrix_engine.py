@@ -0,0 +1,171 @@
+# This script provides a batched matrix backend for calculating the intersection counts between record q-gram sets and
+# reference sets. Chunks of records are converted into q-gram incidence matrices, which are multiplied by the q-gram
+# by reference set incidence matrix, so that the counting is performed by NumPy/BLAS instead of Python set operations.
+#
+# Last modified: 15th October 2026
+
+import itertools
+
+import numpy
+
+# Vocabularies up to this size (all q=2 alphabets) use dense matrices, larger ones use sparse CSR matrices
+DENSE_VOCABULARY_LIMIT = 5000
+
+
+def select_top_ref_sets(count_matrix, sign_length):
+    """ Selects the reference sets with the largest intersection counts for each row of the count matrix, using
+    argpartition. Ties are broken by the reference set index, as in data_encoder.rank_intersect_counts.
+
+     Parameter Description:
+       count_matrix : matrix of intersection counts with a row for each record and a column for each reference set
+       sign_length  : number of reference sets to select for each record
+
+     returns:
+        top_indices : matrix with the indices of the selected reference sets, in descending order of the counts
+        top_counts  : matrix with the intersection counts of the selected reference sets
+    """
+
+    qs_r_count = count_matrix.shape[1]
+    sign_length = min(sign_length, qs_r_count)
+
+    # combine the counts and the reversed indices into unique keys, so that the lower index wins a tie
+    sort_keys = count_matrix.astype(numpy.int64) * qs_r_count + numpy.arange(qs_r_count - 1, -1, -1)
+
+    if sign_length < qs_r_count:
+        top_indices = numpy.argpartition(-sort_keys, sign_length - 1, axis=1)[:, :sign_length]
+    else:
+        top_indices = numpy.tile(numpy.arange(qs_r_count), (count_matrix.shape[0], 1))
+
+    order = numpy.argsort(-numpy.take_along_axis(sort_keys, top_indices, axis=1), axis=1)
+    top_indices = numpy.take_along_axis(top_indices, order, axis=1)
+    top_counts = numpy.take_along_axis(count_matrix, top_indices, axis=1)
+
+    return top_indices, top_counts
+
+
+class MatrixEngine:
+    def __init__(self, indexed_r, chunk_size=10000, dense=None):
+        """ Builds the q-gram by reference set incidence matrix from the processed reference sets
+
+         Parameter Description:
+           indexed_r  : dictionary containing the indexed reference q-gram sets, as returned by
+                        RefSetProcessor.process_ref_q_gram_sets
+           chunk_size : number of records converted into an incidence matrix at once, bounding the memory used
+           dense      : True/False to force dense or sparse matrices, decided using the vocabulary size if None
+        """
+
+        assert sorted(indexed_r.keys()) == list(range(len(indexed_r))), "Reference sets must be indexed from 0"
+
+        self.chunk_size = chunk_size
+        self.qs_r_count = len(indexed_r)
+        self.q_gram_rows = {}
+        for qs_r in indexed_r.values():
+            for q_gram in qs_r:
+                if q_gram not in self.q_gram_rows:
+                    self.q_gram_rows[q_gram] = len(self.q_gram_rows)
+
+        # with integer q-gram identifiers, the rows of the q-grams are looked up in an array instead of the dictionary
+        self.q_gram_row_lookup = None
+        if self.q_gram_rows and all(isinstance(q_gram, int) for q_gram in self.q_gram_rows):
+            self.q_gram_row_lookup = numpy.full(max(self.q_gram_rows) + 1, -1, dtype=numpy.int64)
+            self.q_gram_row_lookup[list(self.q_gram_rows.keys())] = list(self.q_gram_rows.values())
+
+        self.dense = len(self.q_gram_rows) <= DENSE_VOCABULARY_LIMIT if dense is None else dense
+
+        rows = []
+        cols = []
+        for qs_r_index, qs_r in indexed_r.items():
+            for q_gram in qs_r:
+                rows.append(self.q_gram_rows[q_gram])
+                cols.append(qs_r_index)
+
+        if self.dense:
+            # float32 matrices use the BLAS routines, and represent the counts exactly
+            self.incidence_matrix = numpy.zeros((len(self.q_gram_rows), self.qs_r_count), dtype=numpy.float32)
+            self.incidence_matrix[rows, cols] = 1
+        else:
+            from scipy import sparse
+
+            self.incidence_matrix = sparse.csr_matrix((numpy.ones(len(rows), dtype=numpy.int32), (rows, cols)),
+                                                      shape=(len(self.q_gram_rows), self.qs_r_count))
+
+        print("Built %s incidence matrix of %d q-grams and %d reference sets" % (
+            "dense" if self.dense else "sparse", len(self.q_gram_rows), self.qs_r_count))
+
+    def count_intersections(self, record_q_gram_sets):
+        """ Calculates the intersection counts between a chunk of record q-gram sets and all reference sets
+
+         Parameter Description:
+           record_q_gram_sets : list of record q-gram sets
+
+         returns:
+            count_matrix : integer matrix with a row for each record and a column for each reference set
+        """
+
+        if self.q_gram_row_lookup is not None:
+            rows, cols = self.lookup_q_gram_ids(record_q_gram_sets)
+        else:
+            rows = []
+            cols = []
+            for row, record_q_gram_set in enumerate(record_q_gram_sets):
+                for q_gram in record_q_gram_set:
+                    if q_gram in self.q_gram_rows:  # q-grams not in any reference set do not contribute to the counts
+                        rows.append(row)
+                        cols.append(self.q_gram_rows[q_gram])
+
+        if self.dense:
+            record_matrix = numpy.zeros((len(record_q_gram_sets), len(self.q_gram_rows)), dtype=numpy.float32)
+            record_matrix[rows, cols] = 1
+            return (record_matrix @ self.incidence_matrix).astype(numpy.int32)
+        else:
+            from scipy import sparse
+
+            record_matrix = sparse.csr_matrix((numpy.ones(len(rows), dtype=numpy.int32), (rows, cols)),
+                                              shape=(len(record_q_gram_sets), len(self.q_gram_rows)))
+            return (record_matrix @ self.incidence_matrix).toarray()
+
+    def lookup_q_gram_ids(self, record_q_gram_sets):
+        # converts the q-gram identifier arrays of a chunk of records into the row and column indices of the record
+        # incidence matrix, skipping the q-grams not in any reference set
+        set_lengths = [len(record_q_gram_set) for record_q_gram_set in record_q_gram_sets]
+        q_gram_ids = numpy.fromiter(itertools.chain.from_iterable(record_q_gram_sets), dtype=numpy.int64,
+                                    count=sum(set_lengths))
+        rows = numpy.repeat(numpy.arange(len(record_q_gram_sets)), set_lengths)
+
+        in_range = q_gram_ids < len(self.q_gram_row_lookup)
+        cols = self.q_gram_row_lookup[q_gram_ids[in_range]]
+        rows = rows[in_range]
+        return rows[cols >= 0], cols[cols >= 0]
+
+    def iterate_chunks(self, record_q_gram_sets):
+        for chunk_start in range(0, len(record_q_gram_sets), self.chunk_size):
+            yield self.count_intersections(record_q_gram_sets[chunk_start:chunk_start + self.chunk_size])
+
+    def rank_ref_sets(self, record_q_gram_sets, sign_length):
+        """ Ranks the reference sets intersecting with each record, chunk by chunk
+
+         Parameter Description:
+           record_q_gram_sets : list of record q-gram sets
+           sign_length        : maximum number of reference sets to select for each record
+
+         returns:
+            iterator over lists of (reference set index, intersection count) tuples, one for each record, in
+            descending order of the counts with ties broken by the reference set index
+        """
+
+        for count_matrix in self.iterate_chunks(record_q_gram_sets):
+            top_indices, top_counts = select_top_ref_sets(count_matrix, sign_length)
+            for row_indices, row_counts in zip(top_indices.tolist(), top_counts.tolist()):
+                yield [(qs_r_index, count) for qs_r_index, count in zip(row_indices, row_counts) if count > 0]
+
+    def count_touched_ref_sets(self, record_q_gram_sets):
+        """ Returns the minimum number of reference sets that every record has a non-zero intersection with
+        """
+
+        min_touched = None
+        for count_matrix in self.iterate_chunks(record_q_gram_sets):
+            chunk_min = int(numpy.count_nonzero(count_matrix, axis=1).min())
+            if min_touched is None or chunk_min < min_touched:
+                min_touched = chunk_min
+
+        return min_touched
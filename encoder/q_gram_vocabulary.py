@@ -0,0 +1,89 @@
+# This script provides the q-gram vocabulary shared by the reference set generator, the reference set processor and
+# the encoder, which maps every q-gram to a dense integer identifier. Reference sets and record q-gram sets are stored
+# as sorted arrays of these identifiers instead of sets of strings.
+#
+# The identifier of a q-gram made of alphabet characters is its value as a base-|alphabet| number, with the characters
+# as digits (most significant first). As the alphabet is sorted, the identifiers follow the lexicographic order of the
+# q-grams. Q-grams containing characters outside the alphabet are given identifiers from a fallback table, starting at
+# |alphabet|^q, in the order in which they are first seen.
+#
+# Last modified: 15th October 2026
+
+import array
+
+# type code of the arrays storing the q-gram identifiers (signed 32-bit integers)
+Q_GRAM_ID_TYPECODE = 'i'
+MAX_Q_GRAM_ID = 2 ** 31 - 1
+
+
+class QGramVocabulary:
+    def __init__(self, alphabet, q):
+        """ Parameter Description:
+               alphabet : the characters the q-grams are generated from (in any order)
+               q        : length of the q-grams
+        """
+
+        self.alphabet = ''.join(sorted(set(alphabet)))
+        self.q = q
+        self.char_index = {char: index for index, char in enumerate(self.alphabet)}
+        self.base_size = len(self.alphabet) ** q
+        assert self.base_size <= MAX_Q_GRAM_ID, "Too many q-grams to represent as 32-bit identifiers"
+
+        self.q_gram_ids = {}  # cache of the identifiers calculated so far
+        self.fallback_q_grams = []  # q-grams outside the alphabet, the identifier of the i-th is base_size + i
+
+    @classmethod
+    def from_q_grams(cls, q_grams, q):
+        """ Creates the vocabulary of the alphabet made up of all characters of the given q-grams
+        """
+
+        alphabet = set()
+        for q_gram in q_grams:
+            alphabet.update(q_gram)
+        return cls(alphabet, q)
+
+    def __len__(self):
+        return self.base_size + len(self.fallback_q_grams)
+
+    def get_id(self, q_gram):
+        q_gram_id = self.q_gram_ids.get(q_gram)
+        if q_gram_id is not None:
+            return q_gram_id
+
+        if len(q_gram) == self.q and all(char in self.char_index for char in q_gram):
+            q_gram_id = 0
+            for char in q_gram:
+                q_gram_id = q_gram_id * len(self.alphabet) + self.char_index[char]
+        else:
+            q_gram_id = self.base_size + len(self.fallback_q_grams)
+            assert q_gram_id <= MAX_Q_GRAM_ID, "Too many q-grams to represent as 32-bit identifiers"
+            self.fallback_q_grams.append(q_gram)
+
+        self.q_gram_ids[q_gram] = q_gram_id
+        return q_gram_id
+
+    def get_q_gram(self, q_gram_id):
+        if q_gram_id >= self.base_size:
+            return self.fallback_q_grams[q_gram_id - self.base_size]
+
+        chars = []
+        for _ in range(self.q):
+            q_gram_id, char_index = divmod(q_gram_id, len(self.alphabet))
+            chars.append(self.alphabet[char_index])
+        return ''.join(reversed(chars))
+
+    def is_alphabet_id(self, q_gram_id):
+        # checks if the identifier belongs to a q-gram of length q made up of alphabet characters
+        return 0 <= q_gram_id < self.base_size
+
+    def encode_set(self, q_grams):
+        """ Converts a collection of q-grams into a sorted array of unique q-gram identifiers
+        """
+
+        return array.array(Q_GRAM_ID_TYPECODE, sorted(set(self.get_id(q_gram) for q_gram in q_grams)))
+
+    def decode_set(self, q_gram_ids):
+        """ Converts a collection of q-gram identifiers back into a set of q-grams
+        """
+
+        return set(self.get_q_gram(q_gram_id) for q_gram_id in q_gram_ids)
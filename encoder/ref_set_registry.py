@@ -0,0 +1,69 @@
+# This script provides the registry used to keep the reference sets unique, both when generating the initial reference
+# sets (ref-set-generator/generator.py) and when swapping q-grams between them (ref_set_processor.py). Each reference
+# set is registered in its canonical form, a frozenset of its q-grams, so that duplicates are detected in O(1)
+# regardless of the order of the q-grams. When generating very large numbers of reference sets, CompactRefSetRegistry
+# registers a 64-bit digest of each reference set instead, so that its memory use does not grow with the length of the
+# reference sets.
+#
+# CompactRefSetRegistry does not keep the reference sets themselves, so a digest it has already registered cannot be
+# confirmed against the registered reference set: a new reference set whose digest collides with that of a different
+# registered set is rejected as a duplicate. The generator then simply samples again, so the reference sets remain
+# unique and each q-gram still occurs in k reference sets, but from that point on the reference sets differ from the
+# ones generated with RefSetRegistry (generator.py without --stream) for the same seed. With n reference sets, the
+# probability of any collision is about n^2 / 2^65 (below 3e-8 for a million reference sets). Where the output must be
+# exactly reproducible regardless of the registry used, use RefSetRegistry.
+#
+# Last modified: 15th October 2026
+
+import array
+import hashlib
+
+# number of bytes of the digests registered by CompactRefSetRegistry
+REF_SET_DIGEST_SIZE = 8
+
+
+def canonical_ref_set(q_grams):
+    return frozenset(q_grams)
+
+
+def ref_set_digest(q_gram_ids):
+    # digest of the sorted q-gram identifiers of a reference set, as an integer
+    id_bytes = array.array('i', sorted(set(q_gram_ids))).tobytes()
+    return int.from_bytes(hashlib.blake2b(id_bytes, digest_size=REF_SET_DIGEST_SIZE).digest(), 'little')
+
+
+class RefSetRegistry:
+    def __init__(self, ref_sets=()):
+        self.registered_sets = set()
+        for ref_set in ref_sets:
+            self.add(ref_set)
+
+    def canonical(self, q_grams):
+        return canonical_ref_set(q_grams)
+
+    def __contains__(self, q_grams):
+        return self.canonical(q_grams) in self.registered_sets
+
+    def __len__(self):
+        return len(self.registered_sets)
+
+    def add(self, q_grams):
+        self.registered_sets.add(self.canonical(q_grams))
+
+    def replace(self, old_q_grams, new_q_grams):
+        """ Updates the registry after the q-grams of a reference set have been modified
+        """
+
+        self.registered_sets.discard(self.canonical(old_q_grams))
+        self.add(new_q_grams)
+
+
+class CompactRefSetRegistry(RefSetRegistry):
+    """ Registry of reference sets of q-gram identifiers that only keeps a 64-bit digest of each reference set. Two
+    different reference sets with the same digest are reported as duplicates, which causes an additional attempt when
+    generating reference sets and changes the reference sets generated after it (see the header of this file), but is
+    very unlikely (probability about n^2 / 2^65 for n reference sets).
+    """
+
+    def canonical(self, q_grams):
+        return ref_set_digest(q_grams)
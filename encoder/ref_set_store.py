@@ -0,0 +1,155 @@
+# This script stores reference sets on disk in a binary format, shared by the reference set generator, the reference
+# set processor and the encoder. A reference set file (.rsets) consists of:
+# 1. a header (magic number, q, k, reference set length, number of reference sets, alphabet length) followed by the
+#    UTF-8 encoded alphabet, padded to a multiple of 8 bytes
+# 2. a little-endian int32 matrix with one row per reference set, containing the sorted q-gram identifiers of the
+#    reference set in the q_gram_vocabulary.QGramVocabulary of the alphabet and q
+# As the identifiers are sorted and the reference sets are written in order, the same reference sets always produce the
+# same file. The reader memory-maps the matrix, so loading a file does not need to parse the reference sets.
+#
+# Last modified: 15th October 2026
+
+import os
+import struct
+
+import q_gram_vocabulary
+
+REF_SET_FILE_MAGIC = b'RSEREFS1'
+REF_SET_HEADER_FORMAT = '<8sIIIQI'
+REF_SET_HEADER_SIZE = struct.calcsize(REF_SET_HEADER_FORMAT)
+
+REF_SET_FILE_EXTENSION = '.rsets'
+
+
+def get_alphabet_bytes(alphabet):
+    # UTF-8 encoded alphabet, padded so that the matrix starts at a multiple of 8 bytes
+    alphabet_bytes = alphabet.encode('utf8')
+    padding = -(REF_SET_HEADER_SIZE + len(alphabet_bytes)) % 8
+    return alphabet_bytes, padding
+
+
+class RefSetWriter:
+    def __init__(self, file_path, vocabulary, k, r_length, resume_state=None):
+        """ Opens a reference set file for writing. Reference sets can be written one at a time using write, and the
+        number of reference sets is written to the header when the writer is closed. If a resume_state returned by
+        get_state is given, the file is truncated to the state and appended to.
+
+         Parameter Description:
+           file_path    : path of the reference set file
+           vocabulary   : q_gram_vocabulary.QGramVocabulary of the q-gram identifiers of the reference sets
+           k            : number of reference sets in which each q-gram occurs (0 if unknown)
+           r_length     : length of each reference set
+           resume_state : (file offset, number of reference sets) to resume writing an existing file from
+        """
+
+        self.file_path = file_path
+        self.vocabulary = vocabulary
+        self.k = k
+        self.r_length = r_length
+        self.alphabet_bytes, self.padding = get_alphabet_bytes(vocabulary.alphabet)
+
+        if resume_state is None:
+            self.ref_set_count = 0
+            self.ref_set_file = open(file_path, 'wb')
+            self.write_header()
+        else:
+            file_offset, self.ref_set_count = resume_state
+            os.truncate(file_path, file_offset)
+            self.ref_set_file = open(file_path, 'r+b')
+            self.ref_set_file.seek(0, os.SEEK_END)
+
+    def write_header(self):
+        self.ref_set_file.write(struct.pack(REF_SET_HEADER_FORMAT, REF_SET_FILE_MAGIC, self.vocabulary.q, self.k,
+                                            self.r_length, self.ref_set_count, len(self.alphabet_bytes)))
+        self.ref_set_file.write(self.alphabet_bytes + bytes(self.padding))
+
+    def write(self, ref_set):
+        """ Appends a reference set (collection of q-gram identifiers) to the file
+        """
+
+        q_gram_ids = sorted(ref_set)
+        assert len(q_gram_ids) == self.r_length, "Reference sets must be of length %d" % self.r_length
+        assert all(self.vocabulary.is_alphabet_id(q_gram_id) for q_gram_id in q_gram_ids), \
+            "Only q-grams made up of alphabet characters can be stored"
+        self.ref_set_file.write(struct.pack('<%di' % self.r_length, *q_gram_ids))
+        self.ref_set_count += 1
+
+    def read_written_ref_sets(self):
+        """ Iterates over the q-gram identifiers of the reference sets written so far, including those written before
+        resuming, by reading them back from the file (the count in the header is only updated when the writer is closed)
+        """
+
+        self.ref_set_file.flush()
+        row_format = '<%di' % self.r_length
+        row_size = struct.calcsize(row_format)
+        with open(self.file_path, 'rb') as ref_set_file:
+            ref_set_file.seek(REF_SET_HEADER_SIZE + len(self.alphabet_bytes) + self.padding)
+            for _ in range(self.ref_set_count):
+                yield struct.unpack(row_format, ref_set_file.read(row_size))
+
+    def get_state(self):
+        # flushes the file to disk, and returns the file offset and number of reference sets written
+        self.ref_set_file.flush()
+        os.fsync(self.ref_set_file.fileno())
+        return self.ref_set_file.tell(), self.ref_set_count
+
+    def close(self):
+        self.ref_set_file.seek(0)
+        self.write_header()
+        self.ref_set_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def is_ref_set_file(file_path):
+    # checks if the file is a binary reference set file (rather than a CSV file)
+    with open(file_path, 'rb') as ref_set_file:
+        return ref_set_file.read(len(REF_SET_FILE_MAGIC)) == REF_SET_FILE_MAGIC
+
+
+def read_ref_sets(file_path):
+    """ Reads a reference set file written by RefSetWriter. The matrix of q-gram identifiers is memory-mapped.
+
+     Parameter Description:
+       file_path      : path of the reference set file
+
+     returns:
+        ref_set_matrix : read-only memory-mapped int32 matrix with the sorted q-gram identifiers of a reference set in
+                         each row
+        vocabulary     : q_gram_vocabulary.QGramVocabulary of the q-gram identifiers
+        k              : number of reference sets in which each q-gram occurs (0 if unknown)
+    """
+
+    import numpy
+
+    with open(file_path, 'rb') as ref_set_file:
+        magic, q, k, r_length, ref_set_count, alphabet_size = struct.unpack(
+            REF_SET_HEADER_FORMAT, ref_set_file.read(REF_SET_HEADER_SIZE))
+        assert magic == REF_SET_FILE_MAGIC, "%s is not a reference set file" % file_path
+        alphabet = ref_set_file.read(alphabet_size).decode('utf8')
+
+    vocabulary = q_gram_vocabulary.QGramVocabulary(alphabet, q)
+    _, padding = get_alphabet_bytes(alphabet)
+    if ref_set_count == 0:
+        ref_set_matrix = numpy.zeros((0, r_length), dtype='<i4')
+    else:
+        ref_set_matrix = numpy.memmap(file_path, dtype='<i4', mode='r',
+                                      offset=REF_SET_HEADER_SIZE + alphabet_size + padding,
+                                      shape=(ref_set_count, r_length))
+
+    return ref_set_matrix, vocabulary, k
+
+
+def write_ref_sets(file_path, indexed_ref_sets, vocabulary, k=0):
+    """ Writes a dictionary of reference sets indexed from 0 (such as the processed reference sets) to a reference set
+    file, in the order of their indices
+    """
+
+    r_length = len(indexed_ref_sets[0]) if indexed_ref_sets else 0
+    with RefSetWriter(file_path, vocabulary, k, r_length) as ref_set_writer:
+        for index in range(len(indexed_ref_sets)):
+            ref_set_writer.write(indexed_ref_sets[index])
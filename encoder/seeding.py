@@ -0,0 +1,12 @@
+# This script contains the derivation of the seeds of the NumPy random generators from the secret seed value, shared by
+# the reference set processor (ref_set_processor.py) and the reference set generator (ref-set-generator/generator.py),
+# so that the generator does not need to import the processor.
+#
+# Last modified: 15th October 2026
+
+import hashlib
+
+
+def derive_numpy_seed(random_seed):
+    # derives an integer seed for the NumPy random generators from the (string) seed value
+    return int.from_bytes(hashlib.sha256(str(random_seed).encode('utf8')).digest()[:8], 'big')
@@ -0,0 +1,200 @@
+# This script benchmarks the reference set generation (q_gram_generator and ref_set_generator or
+# permutation_layer_generator in generator.py) over a grid of alphabets, q-gram lengths, values of k and reference set
+# lengths. Each configuration is run in a fresh process (see encoder/benchmark_runner.py), and the following are
+# recorded:
+# 1) wall time of generating the q-grams and the reference sets
+# 2) peak resident set size (RSS) of the process
+# 3) number of attempts needed to generate the reference sets (try_counter of ref_set_generator)
+# 4) number of reference sets and size of the CSV output
+# The results are written to a JSON report, and optionally compared against the report of an earlier (baseline) run.
+#
+# Last modified: 15th October 2026
+
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+import generator
+# generator.py adds the encoder directory to the module search path
+import benchmark_runner
+import command_line
+
+# alphabet codes: l = letters, d = digits, s = special characters
+ALPHABET_FLAGS = {'l': 0, 'd': 1, 's': 2}
+
+
+def get_config_key(config):
+    # unique name of a configuration, used to match the results of a run with the results of the baseline
+    return "%s-q%d-k%d-r%d-%s%s" % (config['alphabet'], config['q'], config['k'], config['r_length'], config['mode'],
+                                    '-stream' if config['stream'] else '')
+
+
+def run_configuration(config):
+    """ Runs a single benchmark configuration, in a fresh process started by benchmark_configuration
+
+     Parameter Description:
+       config : dictionary with the alphabet code, q, k, r_length, mode ('sampling' or 'layers'), stream flag and seed
+
+     returns:
+        result : dictionary with the measurements of the configuration
+    """
+
+    alphabet_flags = [code in config['alphabet'] for code in sorted(ALPHABET_FLAGS, key=ALPHABET_FLAGS.get)]
+    stats = {}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_file_path = os.path.join(temp_dir, 'ref_sets.csv')
+
+        # the generator prints the q-grams occurring in k + 1 reference sets, which are not part of the benchmark
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start_time = time.perf_counter()
+            vocabulary, q_grams = generator.q_gram_generator(config['q'], *alphabet_flags)
+            q_gram_time = time.perf_counter() - start_time
+
+            with generator.RefSetCsvWriter(output_file_path, vocabulary) as ref_set_writer:
+                start_time = time.perf_counter()
+                if config['stream']:
+                    generator.ref_set_generator(config['r_length'], q_grams, config['seed'], config['k'],
+                                                ref_set_writer, stats=stats)
+                else:
+                    if config['mode'] == 'layers':
+                        ref_sets = generator.permutation_layer_generator(config['r_length'], q_grams, config['seed'],
+                                                                         config['k'])
+                    else:
+                        ref_sets = generator.ref_set_generator(config['r_length'], q_grams, config['seed'],
+                                                               config['k'], stats=stats)
+                    for ref_set in ref_sets:
+                        ref_set_writer.write(ref_set)
+                generation_time = time.perf_counter() - start_time
+                ref_set_count = ref_set_writer.ref_set_count
+
+        output_size = os.path.getsize(output_file_path)
+
+    result = dict(config)
+    result.update({
+        'key': get_config_key(config),
+        'q_gram_count': len(q_grams),
+        'q_gram_time': q_gram_time,
+        'generation_time': generation_time,
+        'wall_time': q_gram_time + generation_time,
+        'peak_rss_mb': benchmark_runner.get_peak_rss_mb(),
+        'ref_set_count': ref_set_count,
+        'attempts': stats.get('attempts'),
+        'retries': stats['attempts'] - stats['ref_sets'] if stats else None,
+        'max_attempts': stats.get('max_attempts'),
+        'output_bytes': output_size
+    })
+    return result
+
+
+def format_result(result):
+    return "%-28s %8d q-grams %9d sets %9.3f s %8.1f MB %10s attempts" % (
+        result['key'], result['q_gram_count'], result['ref_set_count'], result['wall_time'], result['peak_rss_mb'],
+        result['attempts'] if result['attempts'] is not None else '-')
+
+
+def compare_with_baseline(results, baseline_results, tolerance):
+    """ Compares the wall time and peak RSS of each configuration with the same configuration of the baseline
+
+     Parameter Description:
+       results          : list of the results of this run
+       baseline_results : list of the results of the baseline run
+       tolerance        : relative increase (e.g. 0.25 for 25%) above which a measurement is reported as a regression
+
+     returns:
+        comparisons : list of dictionaries with the ratios of the measurements of each configuration to the baseline
+    """
+
+    baseline_by_key = {result['key']: result for result in baseline_results}
+    comparisons = []
+    for result in results:
+        baseline = baseline_by_key.get(result['key'])
+        if baseline is None:
+            continue
+
+        comparison = {'key': result['key'], 'regressions': []}
+        for metric in ('wall_time', 'peak_rss_mb', 'attempts'):
+            if result[metric] is None or not baseline[metric]:
+                continue
+            ratio = result[metric] / baseline[metric]
+            comparison[metric + '_ratio'] = ratio
+            if ratio > 1 + tolerance:
+                comparison['regressions'].append(metric)
+        comparison['output_changed'] = result['output_bytes'] != baseline['output_bytes'] or \
+            result['ref_set_count'] != baseline['ref_set_count']
+        comparisons.append(comparison)
+
+    return comparisons
+
+
+def parse_list(value, value_type=str):
+    return [value_type(item) for item in value.split(',')]
+
+
+# This program takes in the following command line arguments:
+# 1. The file path the JSON report is written to
+#
+# Optional arguments, given after the positional arguments:
+#   --alphabets : comma separated alphabet codes, made up of l (letters), d (digits) and s (special characters)
+#                 (default 'l,ld')
+#   --q         : comma separated q-gram lengths (default '2,3')
+#   --k         : comma separated values of k (default '3')
+#   --r-length  : comma separated reference set lengths (default '10')
+#   --modes     : comma separated generation modes, 'sampling' and/or 'layers' (default 'sampling')
+#   --stream    : generate the reference sets of the 'sampling' mode using the streaming writer
+#   --seed      : random seed value (default 'benchmark')
+#   --baseline  : file path of the JSON report of an earlier run to compare against. The program exits with status 1
+#                 if the wall time, peak RSS or number of attempts of a configuration increased by more than the
+#                 tolerance
+#   --tolerance : relative increase above which a measurement is reported as a regression (default 0.25)
+
+if __name__ == "__main__":
+    report_path = sys.argv[1]
+    options = command_line.parse_optional_args(sys.argv[2:])
+
+    alphabets = parse_list(options.get('alphabets', 'l,ld'))
+    q_values = parse_list(options.get('q', '2,3'), int)
+    k_values = parse_list(options.get('k', '3'), int)
+    r_lengths = parse_list(options.get('r-length', '10'), int)
+    modes = parse_list(options.get('modes', 'sampling'))
+    stream = 'stream' in options
+    seed = options.get('seed', 'benchmark')
+    baseline_path = options.get('baseline', None)
+    tolerance = float(options.get('tolerance', 0.25))
+
+    for alphabet in alphabets:
+        assert alphabet and all(code in ALPHABET_FLAGS for code in alphabet), "Unknown alphabet code: %s" % alphabet
+    for mode in modes:
+        assert mode in ('sampling', 'layers'), "Unknown generation mode: %s" % mode
+
+    configs = [{'alphabet': alphabet, 'q': q, 'k': k, 'r_length': r_length, 'mode': mode,
+                'stream': stream and mode == 'sampling', 'seed': seed}
+               for alphabet in alphabets for q in q_values for k in k_values for r_length in r_lengths
+               for mode in modes]
+    results = benchmark_runner.run_configurations(run_configuration, configs, format_result)
+    report = benchmark_runner.create_report(results)
+
+    regressions = []
+    if baseline_path is not None:
+        with open(baseline_path) as baseline_file:
+            baseline_report = json.load(baseline_file)
+        report['baseline'] = baseline_path
+        report['comparison'] = compare_with_baseline(results, baseline_report['results'], tolerance)
+
+        print("--------------------- Comparison with %s" % baseline_path)
+        for comparison in report['comparison']:
+            print("%-28s time x%.2f  RSS x%.2f%s%s" % (
+                comparison['key'], comparison.get('wall_time_ratio', 0), comparison.get('peak_rss_mb_ratio', 0),
+                '  output changed' if comparison['output_changed'] else '',
+                '  REGRESSION: ' + ', '.join(comparison['regressions']) if comparison['regressions'] else ''))
+            if comparison['regressions']:
+                regressions.append(comparison['key'])
+
+    benchmark_runner.write_report(report_path, report)
+
+    if regressions:
+        print("Regressions found in %d configurations" % len(regressions))
+        sys.exit(1)
@@ -4,14 +4,26 @@
 # 3) k, the number of reference sets in which each q-gram must occur
 # 4) length of each reference set
 #
-# Last modified: 2025-03-20
+# Last modified: 2026-10-15
 
 import string
 import itertools
+import multiprocessing
+import os
+import pickle
 import random
 import sys
 import csv
 
+# the modules shared with the encoder are located in the encoder directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'encoder'))
+
+import command_line
+import q_gram_vocabulary
+import ref_set_registry
+import ref_set_store
+import seeding
+
 
 def process_boolean_input(input_val):
     if int(input_val) == 1:
@@ -22,7 +34,8 @@ def process_boolean_input(input_val):
 
 def q_gram_generator(q, does_take_ltr, does_take_dig, does_take_sc):
     # Generate the complete set of unique q-grams based on the input flags
-    # for letters, digits, and special characters
+    # for letters, digits, and special characters, as integer q-gram identifiers
+    # of the returned vocabulary
 
     alphabet = ''
     if does_take_ltr:
@@ -34,45 +47,256 @@ def q_gram_generator(q, does_take_ltr, does_take_dig, does_take_sc):
 
     print("Length of alphabet is %d" % len(alphabet))
 
-    q_grams = [''.join(comb) for comb in itertools.product(alphabet, repeat=q)]
+    vocabulary = q_gram_vocabulary.QGramVocabulary(alphabet, q)
+    # the q-grams are listed in the order of the (unsorted) alphabet, so that a seed generates the same reference sets
+    q_grams = [vocabulary.get_id(''.join(comb)) for comb in itertools.product(alphabet, repeat=q)]
 
     print("Generated %d q-grams" % len(q_grams))
-    return q_grams
+    return vocabulary, q_grams
 
 
-def check_q_gram_availability(q_gram_counter, k):
-    for key, value in q_gram_counter.items():
-        if key < k and len(value) > 0:
-            return False
-    return True
+class QGramCounter:
+    def __init__(self, q_grams, k):
+        """ Keeps track of the number of reference sets each q-gram has been added to, with a bucket (list) of q-grams
+        for each count. The position of each q-gram within its bucket is indexed, so that a q-gram is removed from its
+        bucket in O(1) by moving the last q-gram of the bucket into its place, and buckets can be sampled from without
+        copying them.
+        """
 
+        self.buckets = {}
+        self.positions = {}
+        for i in range(k + 1):
+            self.buckets[i] = []
+        for q_gram in q_grams:
+            self.positions[q_gram] = len(self.buckets[0])
+            self.buckets[0].append(q_gram)
 
-def update_q_gram_counter(q_gram_counter, q_grams, key):
-    next_key = key + 1
-    for q_gram in q_grams:
-        q_gram_counter[key].remove(q_gram)
-        if len(q_gram_counter[key]) == 0:
-            del q_gram_counter[key]
-        if next_key not in q_gram_counter:
-            q_gram_counter[next_key] = []
-        q_gram_counter[next_key].append(q_gram)
-    return q_gram_counter
+    @classmethod
+    def from_buckets(cls, buckets):
+        # restores a counter from the buckets of another counter (as saved in a checkpoint)
+        q_gram_counter = cls([], 0)
+        q_gram_counter.buckets = buckets
+        for bucket in buckets.values():
+            for position, q_gram in enumerate(bucket):
+                q_gram_counter.positions[q_gram] = position
+        return q_gram_counter
 
+    def __contains__(self, key):
+        return key in self.buckets
+
+    def __getitem__(self, key):
+        # the bucket of q-grams with the given count, which must not be modified by the caller
+        return self.buckets[key]
+
+    def smallest_key(self):
+        return min(self.buckets.keys())
+
+    def is_complete(self, k):
+        # checks that every q-gram has been added to at least k reference sets
+        for key, bucket in self.buckets.items():
+            if key < k and len(bucket) > 0:
+                return False
+        return True
+
+    def increment(self, q_grams, key):
+        """ Moves the given q-grams from the bucket of count key to the bucket of count key + 1
+        """
+
+        next_key = key + 1
+        for q_gram in q_grams:
+            bucket = self.buckets[key]
+            position = self.positions[q_gram]
+            assert bucket[position] == q_gram
+
+            # swap the q-gram with the last q-gram of the bucket, then remove it
+            last_q_gram = bucket[-1]
+            bucket[position] = last_q_gram
+            self.positions[last_q_gram] = position
+            bucket.pop()
+            if len(bucket) == 0:
+                del self.buckets[key]
+
+            if next_key not in self.buckets:
+                self.buckets[next_key] = []
+            self.positions[q_gram] = len(self.buckets[next_key])
+            self.buckets[next_key].append(q_gram)
 
-def ref_set_generator(r_length, q_c, random_seed, k):
-    random.seed(random_seed)
-    ref_sets = []
-    q_gram_counter = {}
 
-    for i in range(k + 1):
-        if i == 0:
-            q_gram_counter[i] = q_c
+class RefSetCsvWriter:
+    def __init__(self, output_file_path, vocabulary, resume_state=None):
+        """ Writes the reference sets to a CSV file as they are generated, one reference set per row with its q-grams in
+        the order of their identifiers. If a resume_state returned by get_state is given, the file is truncated to the
+        state and appended to.
+        """
+
+        self.vocabulary = vocabulary
+        if resume_state is None:
+            self.ref_set_count = 0
+            self.csv_file = open(output_file_path, 'w', newline='')
         else:
-            q_gram_counter[i] = []
+            file_offset, self.ref_set_count = resume_state
+            os.truncate(output_file_path, file_offset)
+            self.csv_file = open(output_file_path, 'a', newline='')
+        self.csv_writer = csv.writer(self.csv_file)
+
+    def write(self, ref_set):
+        self.csv_writer.writerow([self.vocabulary.get_q_gram(q_gram_id) for q_gram_id in sorted(ref_set)])
+        self.ref_set_count += 1
+
+    def read_written_ref_sets(self):
+        # iterates over the q-gram identifiers of the reference sets written so far, including those written before
+        # resuming, by reading them back from the file
+        self.csv_file.flush()
+        with open(self.csv_file.name, newline='') as csv_file:
+            for row in itertools.islice(csv.reader(csv_file), self.ref_set_count):
+                yield [self.vocabulary.get_id(q_gram) for q_gram in row]
+
+    def get_state(self):
+        # flushes the file to disk, and returns the file offset and number of reference sets written
+        self.csv_file.flush()
+        os.fsync(self.csv_file.fileno())
+        return self.csv_file.buffer.tell(), self.ref_set_count
+
+    def close(self):
+        self.csv_file.close()
+
+    def __enter__(self):
+        return self
 
-    while not check_q_gram_availability(q_gram_counter, k):
-        counter_key = min(q_gram_counter.keys())
-        q_grams_in_smallest_key = list(q_gram_counter[counter_key])
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class GeneratorCheckpoint:
+    def __init__(self, checkpoint_path, interval, resume=False):
+        """ Periodically saves the state of ref_set_generator to a checkpoint file, so that an interrupted run can be
+        resumed and produce exactly the same reference sets as an uninterrupted run. When the reference sets are kept
+        in memory, the sets generated since the previous checkpoint are appended to a log file next to the checkpoint
+        file (checkpoint_path + '.sets'), so that each checkpoint only writes the new reference sets. The registry of the
+        reference sets is not saved, but rebuilt from the logged reference sets (or the output file) on resume
+
+         Parameter Description:
+           checkpoint_path : path of the checkpoint file
+           interval        : number of reference sets generated between checkpoints
+           resume          : if True, the state saved in the checkpoint file is loaded into resume_state
+        """
+
+        self.checkpoint_path = checkpoint_path
+        self.ref_set_log_path = checkpoint_path + '.sets'
+        self.interval = interval
+        self.resume_state = None
+        self.logged_ref_set_count = 0
+        if resume:
+            with open(checkpoint_path, 'rb') as checkpoint_file:
+                self.resume_state = pickle.load(checkpoint_file)
+            if 'ref_set_log_offset' in self.resume_state:
+                self.resume_state['ref_sets'] = self.read_ref_set_log(self.resume_state['ref_set_log_offset'])
+            else:
+                self.resume_state['ref_sets'] = []
+            self.logged_ref_set_count = len(self.resume_state['ref_sets'])
+            print("Resuming from the checkpoint of %d reference sets" % self.resume_state['ref_set_count'])
+
+    def is_due(self, ref_set_count):
+        return ref_set_count % self.interval == 0
+
+    def read_ref_set_log(self, log_offset):
+        # reads the reference sets logged up to the offset saved in the checkpoint, and truncates the log to the offset
+        # (dropping the sets of a checkpoint that was interrupted before the checkpoint file was replaced)
+        ref_sets = []
+        if log_offset == 0:
+            open(self.ref_set_log_path, 'wb').close()
+            return ref_sets
+        os.truncate(self.ref_set_log_path, log_offset)
+        with open(self.ref_set_log_path, 'rb') as log_file:
+            while log_file.tell() < log_offset:
+                ref_sets.extend(pickle.load(log_file))
+        return ref_sets
+
+    def append_ref_set_log(self, ref_sets):
+        # appends the reference sets generated since the previous checkpoint to the log, and returns the new log offset
+        mode = 'ab' if self.logged_ref_set_count > 0 else 'wb'
+        with open(self.ref_set_log_path, mode) as log_file:
+            pickle.dump(ref_sets[self.logged_ref_set_count:], log_file, protocol=pickle.HIGHEST_PROTOCOL)
+            log_file.flush()
+            os.fsync(log_file.fileno())
+            log_offset = log_file.tell()
+        self.logged_ref_set_count = len(ref_sets)
+        return log_offset
+
+    def save(self, parameters, ref_set_count, q_gram_counter, ref_sets, ref_set_writer):
+        # the output file (or the reference set log) is flushed first, so that the checkpoint never refers to reference
+        # sets not on disk
+        state = {
+            'parameters': parameters,
+            'ref_set_count': ref_set_count,
+            'random_state': random.getstate(),
+            'counter_buckets': q_gram_counter.buckets,
+            'writer_state': ref_set_writer.get_state() if ref_set_writer is not None else None
+        }
+        if ref_set_writer is None:
+            # the registry is rebuilt from the logged reference sets on resume (and from the output file otherwise)
+            state['ref_set_log_offset'] = self.append_ref_set_log(ref_sets)
+
+        # written to a temporary file first, so that an interruption never leaves a partial checkpoint
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'wb') as checkpoint_file:
+            pickle.dump(state, checkpoint_file, protocol=pickle.HIGHEST_PROTOCOL)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temp_path, self.checkpoint_path)
+
+
+def ref_set_generator(r_length, q_c, random_seed, k, ref_set_writer=None, checkpoint=None, stats=None,
+                      vocabulary=None):
+    """ Generates the reference sets by repeatedly sampling the q-grams that occur in the fewest reference sets so far
+
+     Parameter Description:
+       r_length       : length of each reference set
+       q_c            : list of all q-gram identifiers
+       random_seed    : seed value of the random number generator
+       k              : number of reference sets in which each q-gram must occur
+       ref_set_writer : if given, each reference set is written using ref_set_writer.write as soon as it is generated
+                        instead of being kept in memory, and only a 64-bit digest of each reference set is kept to
+                        check for duplicates
+       checkpoint     : if given, a GeneratorCheckpoint to save the state to periodically, and to resume from if its
+                        resume_state is set (the ref_set_writer must then be opened with the saved writer state)
+       stats          : if given, a dictionary in which the number of reference sets generated ('ref_sets'), the total
+                        number of attempts to generate them ('attempts') and the largest number of attempts needed for a
+                        single reference set ('max_attempts') are recorded
+       vocabulary     : q_gram_vocabulary.QGramVocabulary of the q-gram identifiers, used to print the q-grams
+
+     returns:
+        ref_sets : list of the reference sets generated (empty if a ref_set_writer is given)
+    """
+
+    parameters = (r_length, len(q_c), str(random_seed), k, ref_set_writer is None)
+    if checkpoint is not None and checkpoint.resume_state is not None:
+        resume_state = checkpoint.resume_state
+        assert resume_state['parameters'] == parameters, "The checkpoint was saved with different parameters"
+        random.setstate(resume_state['random_state'])
+        ref_set_count = resume_state['ref_set_count']
+        ref_sets = resume_state['ref_sets']
+        q_gram_counter = QGramCounter.from_buckets(resume_state['counter_buckets'])
+    else:
+        random.seed(random_seed)
+        ref_set_count = 0
+        ref_sets = []
+        q_gram_counter = QGramCounter(q_c, k)
+
+    # canonical forms of the generated sets, for O(1) duplicate checks
+    if ref_set_writer is None:
+        registry = ref_set_registry.RefSetRegistry()
+    else:
+        registry = ref_set_registry.CompactRefSetRegistry()
+    if checkpoint is not None and checkpoint.resume_state is not None:
+        # the registry is rebuilt from the reference sets generated before the checkpoint, instead of being saved in
+        # each checkpoint
+        for ref_set in (ref_sets if ref_set_writer is None else ref_set_writer.read_written_ref_sets()):
+            registry.add(ref_set)
+
+    while not q_gram_counter.is_complete(k):
+        counter_key = q_gram_counter.smallest_key()
+        q_grams_in_smallest_key = q_gram_counter[counter_key]  # not copied, the bucket is only modified on success
         did_generate_successfully = False
         try_counter = 0
 
@@ -86,22 +310,20 @@ def ref_set_generator(r_length, q_c, random_seed, k):
                         q_grams_in_next_key = q_gram_counter[next_filler_key]
                         q_grams_from_next_key = random.sample(q_grams_in_next_key, k=(r_length - 1))
                         qs_r = set(q_gram_from_smallest_key + q_grams_from_next_key)
-                        if qs_r not in ref_sets:
-                            ref_sets.append(qs_r)
+                        if qs_r not in registry:
+                            registry.add(qs_r)
                             did_generate_successfully = True
-                            q_gram_counter = update_q_gram_counter(q_gram_counter, q_gram_from_smallest_key.copy(),
-                                                                   counter_key)
-                            q_gram_counter = update_q_gram_counter(q_gram_counter, q_grams_from_next_key.copy(),
-                                                                   next_filler_key)
+                            q_gram_counter.increment(q_gram_from_smallest_key, counter_key)
+                            q_gram_counter.increment(q_grams_from_next_key, next_filler_key)
                 else:
-                    random_q_grams = random.sample(q_grams_in_smallest_key.copy(), k=r_length)
+                    random_q_grams = random.sample(q_grams_in_smallest_key, k=r_length)
                     # converting to a set in a separate step to ensure order of q-grams added to the counter,
                     # for reproducibility
                     qs_r = set(random_q_grams)
-                    if qs_r not in ref_sets:
-                        ref_sets.append(qs_r)
+                    if qs_r not in registry:
+                        registry.add(qs_r)
                         did_generate_successfully = True
-                        q_gram_counter = update_q_gram_counter(q_gram_counter, random_q_grams, counter_key)
+                        q_gram_counter.increment(random_q_grams, counter_key)
             else:
                 slack_elements = r_length - len(q_grams_in_smallest_key)
                 next_filler_key = counter_key + 1
@@ -109,21 +331,188 @@ def ref_set_generator(r_length, q_c, random_seed, k):
                 if len(q_grams_in_next_key) >= slack_elements:
                     q_grams_from_next_key = random.sample(q_grams_in_next_key, k=slack_elements)
                     qs_r = set(q_grams_in_smallest_key + q_grams_from_next_key)
-                    if qs_r not in ref_sets:
-                        ref_sets.append(qs_r)
+                    if qs_r not in registry:
+                        registry.add(qs_r)
                         did_generate_successfully = True
-                        q_gram_counter = update_q_gram_counter(q_gram_counter, q_grams_in_smallest_key.copy(),
-                                                               counter_key)
-                        q_gram_counter = update_q_gram_counter(q_gram_counter, q_grams_from_next_key.copy(),
-                                                               next_filler_key)
+                        q_gram_counter.increment(list(q_grams_in_smallest_key), counter_key)
+                        q_gram_counter.increment(q_grams_from_next_key, next_filler_key)
             if did_generate_successfully:
                 assert len(qs_r) == r_length
+                if ref_set_writer is None:
+                    ref_sets.append(qs_r)
+                else:
+                    ref_set_writer.write(qs_r)
+
+                ref_set_count += 1
+                if stats is not None:
+                    stats['ref_sets'] = stats.get('ref_sets', 0) + 1
+                    stats['attempts'] = stats.get('attempts', 0) + try_counter
+                    stats['max_attempts'] = max(stats.get('max_attempts', 0), try_counter)
+                if checkpoint is not None and checkpoint.is_due(ref_set_count):
+                    checkpoint.save(parameters, ref_set_count, q_gram_counter, ref_sets, ref_set_writer)
 
     if (k + 1) in q_gram_counter:
-        print("Elements in the k+1 key are: ", q_gram_counter[k + 1])
+        print("Elements in the k+1 key are: ", decode_q_grams(q_gram_counter[k + 1], vocabulary))
     return ref_sets
 
 
+def decode_q_grams(q_gram_ids, vocabulary):
+    # the q-grams of a list of q-gram identifiers, for printing (the identifiers if no vocabulary is given)
+    if vocabulary is None:
+        return list(q_gram_ids)
+    return [vocabulary.get_q_gram(q_gram_id) for q_gram_id in q_gram_ids]
+
+
+def generate_shard(shard_args):
+    # generates the reference sets of a shard in a worker process
+    r_length, shard_q_grams, shard_seed, k, vocabulary = shard_args
+    return ref_set_generator(r_length, shard_q_grams, shard_seed, k, vocabulary=vocabulary)
+
+
+def sharded_ref_set_generator(r_length, q_c, random_seed, k, num_shards, workers=1, ref_set_writer=None,
+                              vocabulary=None):
+    """ Partitions the q-grams into disjoint shards of random q-grams, and generates the reference sets of each shard
+    independently using ref_set_generator, in parallel processes. The partition and the seeds of the shards are derived
+    from the seed value using a NumPy SeedSequence, so the same seed and number of shards always generate the same
+    reference sets, regardless of the number of processes. As every reference set only contains q-grams of a single
+    shard, no two shards can generate the same reference set.
+
+     Parameter Description:
+       r_length       : length of each reference set
+       q_c            : list of all q-gram identifiers
+       random_seed    : seed value, from which the partition and the seeds of the shards are derived
+       k              : number of reference sets in which each q-gram must occur
+       num_shards     : number of shards to partition the q-grams into
+       workers        : number of processes to generate the shards in
+       ref_set_writer : if given, the reference sets of each shard are written using ref_set_writer.write as soon as the
+                        shard is generated, instead of being returned
+       vocabulary     : q_gram_vocabulary.QGramVocabulary of the q-gram identifiers, used to print the q-grams
+
+     returns:
+        ref_sets : list of the reference sets generated, in the order of the shards (empty if a ref_set_writer is given)
+    """
+
+    import numpy
+
+    assert len(q_c) // num_shards >= r_length, "Shards must contain at least r_length q-grams"
+
+    seed_sequence = numpy.random.SeedSequence(seeding.derive_numpy_seed(random_seed))
+    partition_seed_sequence, *shard_seed_sequences = seed_sequence.spawn(num_shards + 1)
+    permutation = numpy.random.default_rng(partition_seed_sequence).permutation(len(q_c))
+
+    shard_args = []
+    for shard_index, shard_positions in enumerate(numpy.array_split(permutation, num_shards)):
+        shard_seed = int(shard_seed_sequences[shard_index].generate_state(1, dtype=numpy.uint64)[0])
+        shard_args.append((r_length, [q_c[position] for position in shard_positions.tolist()], shard_seed, k,
+                           vocabulary))
+
+    ref_sets = []
+    # global uniqueness check of the merged reference sets
+    if ref_set_writer is None:
+        registry = ref_set_registry.RefSetRegistry()
+    else:
+        registry = ref_set_registry.CompactRefSetRegistry()
+
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        shard_results = pool.imap(generate_shard, shard_args) if pool is not None else map(generate_shard, shard_args)
+        for shard_index, shard_ref_sets in enumerate(shard_results):
+            print("Generated %d reference sets in shard %d" % (len(shard_ref_sets), shard_index))
+            for qs_r in shard_ref_sets:
+                assert qs_r not in registry, "Duplicate reference set generated in shard %d" % shard_index
+                registry.add(qs_r)
+                if ref_set_writer is None:
+                    ref_sets.append(qs_r)
+                else:
+                    ref_set_writer.write(qs_r)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return ref_sets
+
+
+def find_invalid_layer_rows(rows):
+    """ Finds the rows of the reference set matrix that contain the same q-gram more than once, or that contain the same
+    q-grams as an earlier row
+
+     returns:
+        invalid_rows : array of the indices of the invalid rows
+        repeat_mask  : boolean matrix marking, within each row, the positions of q-grams that occur more than once
+    """
+
+    import numpy
+
+    sorted_rows = numpy.sort(rows, axis=1)
+    has_repeat = (sorted_rows[:, 1:] == sorted_rows[:, :-1]).any(axis=1)
+
+    _, first_occurrences = numpy.unique(sorted_rows, axis=0, return_index=True)
+    is_duplicate = numpy.ones(len(rows), dtype=bool)
+    is_duplicate[first_occurrences] = False
+
+    invalid_rows = numpy.flatnonzero(has_repeat | is_duplicate)
+    repeat_mask = numpy.zeros((len(invalid_rows), rows.shape[1]), dtype=bool)
+    for i, row in enumerate(rows[invalid_rows]):
+        _, inverse, counts = numpy.unique(row, return_inverse=True, return_counts=True)
+        repeat_mask[i] = counts[inverse] > 1
+
+    return invalid_rows, repeat_mask
+
+
+def permutation_layer_generator(r_length, q_c, random_seed, k, max_repair_rounds=1000, vocabulary=None):
+    """ Generates the reference sets as k coverage layers, each layer being a random permutation of the q-grams cut into
+    rows of r_length q-grams. The layers are concatenated, so a row can span two layers, and the last row is padded
+    with q-grams from an additional permutation (these q-grams occur in k + 1 reference sets). Rows containing the same
+    q-gram twice, or duplicating another row, are repaired by swapping one of their q-grams with a randomly chosen
+    position of another row, which keeps the number of occurrences of every q-gram unchanged.
+
+     Parameter Description:
+       r_length          : length of each reference set
+       q_c               : list of all q-gram identifiers
+       random_seed       : seed value, from which the seed of the NumPy random generator is derived
+       k                 : number of reference sets in which each q-gram must occur
+       max_repair_rounds : maximum number of rounds to repair the invalid rows in
+       vocabulary        : q_gram_vocabulary.QGramVocabulary of the q-gram identifiers, used to print the q-grams
+
+     returns:
+        ref_sets : list of the reference sets generated
+    """
+
+    import numpy
+
+    assert r_length <= len(q_c), "Reference sets cannot be longer than the number of q-grams"
+    rng = numpy.random.default_rng(seeding.derive_numpy_seed(random_seed))
+
+    num_sets = -(-k * len(q_c) // r_length)
+    padding = num_sets * r_length - k * len(q_c)
+    layers = [rng.permutation(len(q_c)) for _ in range(k)] + [rng.permutation(len(q_c))[:padding]]
+    rows = numpy.concatenate(layers).reshape(num_sets, r_length)
+
+    for repair_round in range(max_repair_rounds):
+        invalid_rows, repeat_mask = find_invalid_layer_rows(rows)
+        if len(invalid_rows) == 0:
+            break
+        if repair_round == 0:
+            print("Repairing %d invalid reference sets" % len(invalid_rows))
+
+        for invalid_row, row_repeats in zip(invalid_rows, repeat_mask):
+            # swap out a repeated q-gram if there is one, otherwise any q-gram of the row
+            candidate_cols = numpy.flatnonzero(row_repeats) if row_repeats.any() else numpy.arange(r_length)
+            col = rng.choice(candidate_cols)
+            other_row = rng.integers(num_sets)
+            other_col = rng.integers(r_length)
+            rows[invalid_row, col], rows[other_row, other_col] = rows[other_row, other_col], rows[invalid_row, col]
+    else:
+        raise ValueError("Could not generate %d unique reference sets of length %d" % (num_sets, r_length))
+
+    extra_q_grams = [q_c[q_gram_index] for q_gram_index in layers[-1]]
+    if extra_q_grams:
+        print("Elements in the k+1 key are: ", decode_q_grams(extra_q_grams, vocabulary))
+
+    return [set(q_c[q_gram_index] for q_gram_index in row) for row in rows.tolist()]
+
+
 # This program takes in the following command line arguments:
 # 1. The random seed value
 # 2. Flag for if the q-grams should include letters (1 for True, 0 for False)
@@ -133,6 +522,23 @@ def ref_set_generator(r_length, q_c, random_seed, k):
 # 6. Value of k, determining the number of reference sets in which each q-gram must occur
 # 7. Length of each reference set
 # 8. The output file name to which the reference sets will be written
+#
+# Optional arguments, given after the positional arguments:
+#   --mode : 'sampling' (default) to generate the reference sets using ref_set_generator, or 'layers' to generate them
+#            as permuted coverage layers using permutation_layer_generator (requires NumPy)
+#   --stream : in 'sampling' mode, write each reference set to the output file as soon as it is generated, keeping only
+#              a digest of each reference set in memory (the output is identical unless two of the digests collide,
+#              which is very unlikely, see encoder/ref_set_registry.py)
+#   --shards : in 'sampling' mode, number of disjoint shards of q-grams to generate the reference sets of independently
+#              (default 1, no sharding). The output depends on the seed and the number of shards, but not on --workers
+#   --workers : number of processes to generate the shards in (default 1)
+#   --output-format : 'csv' (default) to write a reference set per row, or 'binary' to write a binary reference set
+#                     file of sorted q-gram identifiers (see encoder/ref_set_store.py)
+#   --checkpoint : in 'sampling' mode without sharding, path of a checkpoint file the state of the generation is saved to
+#                  (without --stream, the reference sets generated so far are also logged to the file path + '.sets')
+#   --checkpoint-every : number of reference sets generated between checkpoints (default 100000)
+#   --resume : resume the generation from the --checkpoint file, which produces the same output as an uninterrupted run
+#              (the other arguments must be the same as in the interrupted run)
 
 if __name__ == "__main__":
     random_seed_val = str(sys.argv[1])
@@ -145,9 +551,54 @@ if __name__ == "__main__":
     l_r = int(sys.argv[7])
     output_file_path = sys.argv[8]
 
-    q_common = q_gram_generator(q_gram_length, include_letters, include_digits, include_sc)
-    ref_set_col = ref_set_generator(l_r, q_common, random_seed_val, k)
+    options = command_line.parse_optional_args(sys.argv[9:])
+    generation_mode = options.get('mode', 'sampling')
+    assert generation_mode in ('sampling', 'layers'), "Unknown generation mode: %s" % generation_mode
+    stream = 'stream' in options
+    num_shards = int(options.get('shards', 1))
+    num_workers = int(options.get('workers', 1))
+    output_format = options.get('output-format', 'csv')
+    assert output_format in ('csv', 'binary'), "Unknown output format: %s" % output_format
+    assert not (stream and generation_mode == 'layers'), "Streaming is only supported in 'sampling' mode"
+    checkpoint_path = options.get('checkpoint', None)
+    checkpoint_interval = int(options.get('checkpoint-every', 100000))
+    resume = 'resume' in options
+    assert not resume or checkpoint_path is not None, "Resuming requires a --checkpoint file"
+    assert checkpoint_path is None or (generation_mode == 'sampling' and num_shards == 1), \
+        "Checkpoints are only supported in 'sampling' mode without sharding"
+    assert num_shards == 1 or generation_mode == 'sampling', "Sharding is only supported in 'sampling' mode"
+
+    q_vocabulary, q_common = q_gram_generator(q_gram_length, include_letters, include_digits, include_sc)
+    generator_checkpoint = None
+    writer_state = None
+    if checkpoint_path is not None:
+        generator_checkpoint = GeneratorCheckpoint(checkpoint_path, checkpoint_interval, resume)
+        if resume:
+            writer_state = generator_checkpoint.resume_state['writer_state']
+
+    if output_format == 'binary':
+        output_writer = ref_set_store.RefSetWriter(output_file_path, q_vocabulary, k, l_r, writer_state)
+    else:
+        output_writer = RefSetCsvWriter(output_file_path, q_vocabulary, writer_state)
+
+    with output_writer:
+        if num_shards > 1:
+            ref_set_col = sharded_ref_set_generator(l_r, q_common, random_seed_val, k, num_shards, num_workers,
+                                                    output_writer if stream else None, q_vocabulary)
+            for ref_set in ref_set_col:
+                output_writer.write(ref_set)
+        elif stream:
+            ref_set_generator(l_r, q_common, random_seed_val, k, output_writer, generator_checkpoint,
+                              vocabulary=q_vocabulary)
+        else:
+            if generation_mode == 'layers':
+                ref_set_col = permutation_layer_generator(l_r, q_common, random_seed_val, k,
+                                                          vocabulary=q_vocabulary)
+            else:
+                ref_set_col = ref_set_generator(l_r, q_common, random_seed_val, k, checkpoint=generator_checkpoint,
+                                                vocabulary=q_vocabulary)
+
+            for ref_set in ref_set_col:
+                output_writer.write(ref_set)
 
-    with open(output_file_path, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerows(ref_set_col)
+    print("Wrote %d reference sets to %s" % (output_writer.ref_set_count, output_file_path))
@@ -0,0 +1,139 @@
+# Tests of the swap modes of the reference set processor (encoder/ref_set_processor.py), run with
+# python -m unittest discover -s tests
+#
+# Last modified: 15th October 2026
+
+import contextlib
+import io
+import itertools
+import os
+import sys
+import unittest
+from unittest import mock
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'encoder'))
+
+import ref_set_processor
+
+
+def make_weighed_ref_sets(ref_set_count, r_length, q_gram_count, seed=0):
+    # random reference sets of distinct q-grams with random (skewed) q-gram frequencies
+    rng = numpy.random.default_rng(seed)
+    ref_set_matrix = numpy.array([rng.choice(q_gram_count, r_length, replace=False) for _ in range(ref_set_count)],
+                                 dtype=numpy.int32).reshape(ref_set_count, r_length)
+    freq_table = (rng.pareto(1.5, q_gram_count) * 100).astype(numpy.int64) + 1
+    return ref_set_processor.WeighedRefSets(ref_set_matrix, freq_table)
+
+
+def get_brute_force_max_overlap(ref_set_matrix):
+    # the largest number of q-grams shared by two different reference sets, comparing all pairs
+    q_gram_sets = [set(q_gram_ids) for q_gram_ids in ref_set_matrix.tolist()]
+    return max((len(q_gram_sets[key] & q_gram_sets[other_key]) for key in range(len(q_gram_sets))
+                for other_key in range(key + 1, len(q_gram_sets))), default=0)
+
+
+class OverlapTest(unittest.TestCase):
+    def test_max_overlap(self):
+        for ref_set_count, r_length, q_gram_count in ((0, 4, 10), (1, 4, 10), (40, 4, 10), (200, 8, 40)):
+            ref_set_matrix = make_weighed_ref_sets(ref_set_count, r_length, q_gram_count).ref_set_matrix
+            self.assertEqual(ref_set_processor.get_max_overlap(ref_set_matrix),
+                             get_brute_force_max_overlap(ref_set_matrix))
+
+    def test_overlapping_pairs_of_keys(self):
+        ref_set_matrix = make_weighed_ref_sets(100, 6, 30).ref_set_matrix
+        q_gram_sets = [set(q_gram_ids) for q_gram_ids in ref_set_matrix.tolist()]
+        keys = numpy.array([0, 5, 17])
+        expected_pairs = [(key, other_key) for key in range(100) for other_key in range(key + 1, 100)
+                          if (key in keys or other_key in keys) and len(q_gram_sets[key] & q_gram_sets[other_key]) > 2]
+        self.assertEqual(sorted(ref_set_processor.find_overlapping_pairs(ref_set_matrix, 2, keys)), expected_pairs)
+
+
+class GlobalBalancingTest(unittest.TestCase):
+    def test_overlap_not_above_initial(self):
+        for ref_set_count, r_length, q_gram_count, seed in ((300, 5, 60, 0), (200, 10, 50, 1), (100, 20, 80, 2)):
+            weighed_random_sets = make_weighed_ref_sets(ref_set_count, r_length, q_gram_count, seed)
+            initial_ref_set_matrix = weighed_random_sets.ref_set_matrix.copy()
+            with contextlib.redirect_stdout(io.StringIO()):
+                balanced_ref_sets, _ = ref_set_processor.global_balancing(weighed_random_sets, str(seed))
+
+            ref_set_matrix = balanced_ref_sets.ref_set_matrix
+            self.assertLessEqual(get_brute_force_max_overlap(ref_set_matrix),
+                                 get_brute_force_max_overlap(initial_ref_set_matrix))
+            # each q-gram occurs in as many reference sets as before, and the reference sets are unique
+            self.assertEqual(numpy.bincount(ref_set_matrix.ravel(), minlength=q_gram_count).tolist(),
+                             numpy.bincount(initial_ref_set_matrix.ravel(), minlength=q_gram_count).tolist())
+            self.assertEqual(len(numpy.unique(numpy.sort(ref_set_matrix, axis=1), axis=0)), ref_set_count)
+
+
+class SelectRoundPairsTest(unittest.TestCase):
+    def test_no_pairs_for_fewer_than_two_ref_sets(self):
+        for ref_set_count in (0, 1):
+            weighed_random_sets = ref_set_processor.WeighedRefSets(
+                numpy.zeros((ref_set_count, 3), dtype=numpy.int32), numpy.ones(3, dtype=numpy.int64))
+            self.assertEqual(ref_set_processor.select_round_pairs(weighed_random_sets, 10), [])
+
+    def test_pairs_lowest_with_highest(self):
+        weighed_random_sets = make_weighed_ref_sets(20, 4, 50)
+        min_key, max_key = ref_set_processor.select_round_pairs(weighed_random_sets, 10)[0]
+        self.assertEqual(weighed_random_sets.freq_sums[min_key], weighed_random_sets.freq_sums.min())
+        self.assertEqual(weighed_random_sets.freq_sums[max_key], weighed_random_sets.freq_sums.max())
+
+
+class FindBalancingSwapsTest(unittest.TestCase):
+    def test_balancing_swaps(self):
+        weighed_random_sets = make_weighed_ref_sets(200, 6, 40, seed=3)
+        min_keys, max_keys = numpy.array(ref_set_processor.select_round_pairs(weighed_random_sets, 100)).T
+        pair_rows = (weighed_random_sets.ref_set_matrix[min_keys], weighed_random_sets.freq_matrix[min_keys],
+                     weighed_random_sets.ref_set_matrix[max_keys], weighed_random_sets.freq_matrix[max_keys])
+        min_positions, max_positions = ref_set_processor.find_balancing_swaps(pair_rows)
+
+        for pair, (min_ids, min_freqs, max_ids, max_freqs) in enumerate(zip(*pair_rows)):
+            freq_sum_range = int(max_freqs.sum() - min_freqs.sum())
+            # the first swap of the q-grams in order of position that leaves the pair closest to balanced
+            best_swap = (-1, None)
+            best_imbalance = None
+            for min_position, max_position in itertools.product(range(len(min_ids)), range(len(max_ids))):
+                freq_diff = int(max_freqs[max_position] - min_freqs[min_position])
+                if 0 < freq_diff < freq_sum_range and min_ids[min_position] not in max_ids and \
+                        max_ids[max_position] not in min_ids:
+                    imbalance = abs(2 * freq_diff - freq_sum_range)
+                    if best_imbalance is None or imbalance < best_imbalance:
+                        best_swap = (min_position, max_position)
+                        best_imbalance = imbalance
+            self.assertEqual(min_positions[pair], best_swap[0])
+            if best_imbalance is not None:
+                self.assertEqual(max_positions[pair], best_swap[1])
+
+
+class BatchedRankSwappingTest(unittest.TestCase):
+    def test_parallel_rounds(self):
+        results = []
+        for workers in (1, 2):
+            weighed_random_sets = make_weighed_ref_sets(300, 5, 60, seed=1)
+            initial_ref_set_matrix = weighed_random_sets.ref_set_matrix.copy()
+            with mock.patch.object(ref_set_processor, 'PARALLEL_CANDIDATE_THRESHOLD', 0), \
+                    mock.patch.object(ref_set_processor, 'PAIR_CHUNK_CANDIDATES', 100), \
+                    contextlib.redirect_stdout(io.StringIO()):
+                weighed_random_sets, swaps = ref_set_processor.batched_rank_swapping(weighed_random_sets, 50, workers)
+            ref_set_matrix = weighed_random_sets.ref_set_matrix
+            self.assertGreater(swaps, 0)
+            self.assertEqual(numpy.bincount(ref_set_matrix.ravel(), minlength=60).tolist(),
+                             numpy.bincount(initial_ref_set_matrix.ravel(), minlength=60).tolist())
+            self.assertEqual(len(numpy.unique(numpy.sort(ref_set_matrix, axis=1), axis=0)), len(ref_set_matrix))
+            self.assertEqual(weighed_random_sets.freq_sums.tolist(),
+                             weighed_random_sets.freq_table[ref_set_matrix].sum(axis=1).tolist())
+            results.append(ref_set_matrix.tolist())
+        self.assertEqual(results[0], results[1])
+
+    def test_single_ref_set(self):
+        weighed_random_sets = ref_set_processor.WeighedRefSets(numpy.array([[0, 1, 2]], dtype=numpy.int32),
+                                                               numpy.arange(1, 4, dtype=numpy.int64))
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, swaps = ref_set_processor.batched_rank_swapping(weighed_random_sets, 10)
+        self.assertEqual(swaps, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()